@@ -64,7 +64,8 @@ def calc_charging_distributions(tfs):
 def create_parking_and_driving_maps(tfs):
 
     """ Normalizes state and state transition matrices and produces
-    the resulting parking and driving maps.
+    the resulting parking and driving maps. Cars are counted per city zone
+    position of state_tensor, which corresponds to the rows of the maps.
     """
 
     driving_map = np.zeros(
@@ -79,16 +80,36 @@ def create_parking_and_driving_maps(tfs):
             tfs.T
         )
     )
-    for car in range(tfs.C):
-    
-        for t in range(tfs.T):
-            zone = tfs.state_tensor[car, t]
-            driving_activity = tfs.transition_tensor[car, t, 0]
+    for t in range(tfs.T):
+        zone = tfs.state_tensor[:, t]
+        driving_activity = tfs.transition_tensor[:, t, 0] == 1
+
+        # count all cars and driving cars per zone
+        driving_map[:, t] = np.bincount(
+            zone[driving_activity],
+            minlength=tfs.number_zones
+        )
+        parking_map[:, t] = np.bincount(
+            zone,
+            minlength=tfs.number_zones
+        ) - driving_map[:, t]
+
+    normalize_parking_and_driving_maps(
+        tfs,
+        driving_map,
+        parking_map
+    )
 
-            if driving_activity == 1:
-                driving_map[zone-1, t] += 1
-            else:
-                parking_map[zone-1, t] += 1
+
+def normalize_parking_and_driving_maps(
+    tfs,
+    driving_map,
+    parking_map
+):
+
+    """ Normalizes counts of driving and parking cars per city zone and time
+    step to the parking and driving maps.
+    """
 
     tfs.driving_map = driving_map / np.sum(driving_map)
     tfs.parking_map = parking_map / np.sum(parking_map)
@@ -113,6 +134,22 @@ def calc_traffic_properties(tfs):
         avg_properties[t+1, 0] = np.mean(driving_time_t)
         avg_properties[t+1, 1] = np.mean(driving_distance_t)
         
+    summarize_traffic_properties(
+        tfs,
+        avg_properties
+    )
+
+
+def summarize_traffic_properties(
+    tfs,
+    avg_properties
+):
+
+    """ Calculates driving and parking shares per lifetime and the circadian 
+    rhythm of traffic from average driving times and distances per time step,
+    which are passed in rows 1 to T of avg_properties.
+    """
+
     avg_properties[0, 0] = np.mean(avg_properties[1:, 0])
     avg_properties[0, 1] = np.mean(avg_properties[1:, 1])
     
@@ -140,73 +177,207 @@ def calc_traffic_properties(tfs):
     tfs.circadian_rhythm = circadian_rhythm
 
 
-def calc_travel_distributions(tfs):
+def calc_aggregate_system_properties(tfs):
+
+    """ Calculates the traffic system properties from zone level counts of
+    driving and parking cars and aggregates of trips per time step. These are
+    accumulated during sampling by samp_cohort.sample_traffic_cohorts(), 
+    samp_cohort.expect_traffic_cohorts() and samp_traf.sample_traffic() in
+    streaming mode.
+    """
     
-    """ calculates the multivariate distribution of travelled distances and 
-    durations for both fine-grained time steps and all time steps together.
+    normalize_parking_and_driving_maps(
+        tfs,
+        tfs.driving_counts,
+        tfs.parking_counts
+    )
+    
+    # average driving times in minutes and distances over all cars
+    avg_properties = np.zeros(
+        (
+            tfs.T+1,
+            2
+        )
+    )
+    avg_properties[1:, 0] = tfs.travel_time_sums / 60 / tfs.C
+    avg_properties[1:, 1] = tfs.travel_distance_sums / tfs.C
+    summarize_traffic_properties(
+        tfs,
+        avg_properties
+    )
+    
+    summarize_travel_distributions(
+        tfs,
+        tfs.duration_counts_per_t,
+        tfs.distance_counts_per_t,
+        tfs.duration_bin_edges,
+        tfs.distance_bin_edges
+    )
+    calc_charging_distributions(tfs)
+    
+
+def create_travel_bin_edges(
+    tfs,
+    number_bins=10
+):
+
+    """ Creates bin edges of travel durations and distances that are known 
+    before sampling. Durations range up to the largest mean travel time plus
+    three standard deviations and at least five minutes of intra-zone trips.
+    Distances range up to the largest od distance plus three standard 
+    deviations of 0.1 km. Values beyond the last edge are counted in the last
+    bin.
+    """
+    
+    max_duration = np.amax(tfs.datatensor_mean)
+    if type(tfs.datatensor_stddev) != int:
+        max_duration += 3 * np.amax(tfs.datatensor_stddev)
+    else:
+        max_duration += 3
+    max_duration = max(max_duration, 5 * 60)
+    max_distance = max(np.amax(tfs.od_distances_array) + 0.3, 1)
+    
+    duration_bin_edges = np.linspace(0, max_duration, number_bins + 1)
+    distance_bin_edges = np.linspace(0, max_distance, number_bins + 1)
+    
+    return duration_bin_edges, distance_bin_edges
+    
+
+def calc_bin_index(
+    values,
+    bin_edges
+):
+
+    """ Returns the bin index of travel durations or distances in equally
+    spaced bin_edges by index arithmetic. Values beyond the last edge are 
+    assigned to the last bin.
     """
     
-    # calculate overall distributions
-    duration_histogram = np.histogram(
-        tfs.transition_tensor[:, :, 2]
+    number_bins = len(bin_edges) - 1
+    bin_width = bin_edges[1] - bin_edges[0]
+    
+    return np.clip(
+        ((values - bin_edges[0]) / bin_width).astype(np.int64),
+        0,
+        number_bins - 1
     )
-    distance_histogram = np.histogram(
-        tfs.transition_tensor[:, :, 3]
+    
+
+def count_travel_bins(
+    values,
+    bin_edges,
+    weights=None
+):
+
+    """ Counts travel durations or distances of a single time step per bin of
+    bin_edges. Used for accumulating distributions during sampling.
+    """
+    
+    return np.bincount(
+        calc_bin_index(values, bin_edges),
+        weights=weights,
+        minlength=len(bin_edges) - 1
     )
-    bins_km = distance_histogram[1][1:]
-    bins_s = duration_histogram[1][1:]
-    distr_durations_total = np.round(
-        duration_histogram[0] / sum(duration_histogram[0]) * 100,
+    
+
+def summarize_travel_distributions(
+    tfs,
+    duration_counts_per_t,
+    distance_counts_per_t,
+    duration_bin_edges,
+    distance_bin_edges
+):
+
+    """ Calculates the distributions of travelled distances and durations
+    from counts per time step and bin.
+    """
+    
+    duration_counts_total = np.sum(duration_counts_per_t, axis=0)
+    distance_counts_total = np.sum(distance_counts_per_t, axis=0)
+    
+    tfs.distr_durations_per_t = duration_counts_per_t
+    tfs.distr_distances_per_t = distance_counts_per_t
+    tfs.distr_durations_total = np.round(
+        duration_counts_total / sum(duration_counts_total) * 100,
         2
     )
-    distr_distances_total = np.round(
-        distance_histogram[0] / sum(distance_histogram[0]) * 100,
+    tfs.distr_distances_total = np.round(
+        distance_counts_total / sum(distance_counts_total) * 100,
         2
     )
-    distr_durations_per_t = np.zeros(
-        (
-            tfs.T,
-            len(bins_s)
-        )
+    tfs.distr_bins_s = duration_bin_edges[1:]
+    tfs.distr_bins_km = distance_bin_edges[1:]
+    
+
+def calc_travel_distributions(tfs):
+    
+    """ calculates the multivariate distribution of travelled distances and 
+    durations for both fine-grained time steps and all time steps together.
+    Each quantity is binned by time step and value together in a single pass
+    over fixed bin edges from create_travel_bin_edges(). Zero entries of 
+    parked cars are only counted if tfs.include_parked_in_distr is True.
+    """
+    
+    (
+        duration_bin_edges,
+        distance_bin_edges
+    ) = create_travel_bin_edges(tfs)
+    
+    # only count entries of driving cars if parked cars are excluded
+    if tfs.include_parked_in_distr:
+        car_mask = None
+    else:
+        car_mask = tfs.transition_tensor[:, :, 0] == 1
+    
+    duration_counts_per_t = count_travel_bins_per_t(
+        tfs.transition_tensor[:, :, 2],
+        duration_bin_edges,
+        car_mask
     )
-    distr_distances_per_t = np.zeros(
-        (
-            tfs.T,
-            len(bins_km)
-        )
+    distance_counts_per_t = count_travel_bins_per_t(
+        tfs.transition_tensor[:, :, 3],
+        distance_bin_edges,
+        car_mask
     )
     
-    # calculate distributions over each time step
-    for t in range(tfs.T):
-        durations_t = tfs.transition_tensor[:, t, 2]
-        distances_t = tfs.transition_tensor[:, t, 3]
-        distr_durations_t = np.histogram(
-            durations_t,
-            len(bins_s),
-            (
-                bins_s[0],
-                bins_s[-1]
-            )
-        )[0]
-        distr_distances_t = np.histogram(
-            distances_t,
-            len(bins_km),
-            (
-                bins_km[0],
-                bins_km[-1]
-            )
-        )[0]
-        
-        distr_durations_per_t[t, :] = distr_durations_t
-        distr_distances_per_t[t, :] = distr_distances_t
+    summarize_travel_distributions(
+        tfs,
+        duration_counts_per_t,
+        distance_counts_per_t,
+        duration_bin_edges,
+        distance_bin_edges
+    )
+
+
+def count_travel_bins_per_t(
+    values,
+    bin_edges,
+    car_mask=None
+):
+
+    """ Counts C x T travel durations or distances per time step and bin of
+    bin_edges with a single bincount over combined time step and bin keys.
+    If car_mask is passed, only entries where it is True are counted.
+    """
+    
+    number_bins = len(bin_edges) - 1
+    T = values.shape[1]
+    
+    # combined key of time step and bin for every entry
+    key = (
+        calc_bin_index(values, bin_edges)
+        + np.arange(T) * number_bins
+    )
+    if car_mask is not None:
+        key = key[car_mask]
         
-    # assign as class properties
-    tfs.distr_distances_per_t = distr_distances_per_t
-    tfs.distr_durations_per_t = distr_durations_per_t
-    tfs.distr_distances_total = distr_distances_total
-    tfs.distr_durations_total = distr_durations_total
-    tfs.distr_bins_km = bins_km
-    tfs.distr_bins_s = bins_s
-    
-      
+    return np.bincount(
+        key.ravel(),
+        minlength=T * number_bins
+    ).reshape(
+        (
+            T,
+            number_bins
+        )
+    )
         
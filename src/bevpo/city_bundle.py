@@ -0,0 +1,355 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+
+# version of the bundle layout. Bundles of other versions are rebuilt
+BUNDLE_VERSION = 1
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def calc_content_hash(
+    path_list,
+    parameters=None,
+    path_to_bundle=None
+):
+
+    """ Calculates a sha256 hash over the content of all files in path_list,
+    the parameters dictionary and BUNDLE_VERSION. If the manifest of
+    path_to_bundle holds the hash of a file whose size and modification time
+    did not change, that hash is reused instead of reading the file again,
+    so that checking a bundle of large source files is fast. Returns the
+    content hash and a dictionary of file hashes for save_bundle_arrays().
+    """
+
+    manifest = read_manifest(path_to_bundle)
+    if manifest is None:
+        known_file_dict = {}
+    else:
+        known_file_dict = manifest.get('source_files', {})
+
+    content_hash = hashlib.sha256()
+    content_hash.update(str(BUNDLE_VERSION).encode())
+    file_dict = {}
+
+    for path in path_list:
+        file_stat = os.stat(path)
+        file_key = os.path.abspath(path)
+        known_file = known_file_dict.get(file_key)
+
+        if (
+            known_file is not None
+            and known_file['size'] == file_stat.st_size
+            and known_file['mtime_ns'] == file_stat.st_mtime_ns
+        ):
+            file_hash = known_file['hash']
+        else:
+            file_hash = calc_file_hash(path)
+
+        file_dict[file_key] = {
+            'size': file_stat.st_size,
+            'mtime_ns': file_stat.st_mtime_ns,
+            'hash': file_hash
+        }
+        content_hash.update(file_hash.encode())
+
+    content_hash.update(
+        json.dumps(
+            parameters,
+            sort_keys=True,
+            default=str
+        ).encode()
+    )
+
+    return content_hash.hexdigest(), file_dict
+
+
+def calc_file_hash(
+    path,
+    block_size=2**20
+):
+
+    """ Calculates the sha256 hash of a file, reading it in blocks of
+    block_size bytes. """
+
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def calc_array_hash(array):
+
+    """ Calculates the sha256 hash of the values, shape and data type of a
+    numpy array. Used to key derived arrays to the zones they belong to.
+    """
+
+    array = np.ascontiguousarray(array)
+    array_hash = hashlib.sha256()
+    array_hash.update(str((array.shape, array.dtype.str)).encode())
+    array_hash.update(array.tobytes())
+
+    return array_hash.hexdigest()
+
+
+def calc_tensor_hash(tensor):
+
+    """ Calculates the sha256 hash of the values, shape and data type of a
+    number_zones x number_zones x T tensor one time slice at a time, so that
+    tensors backed by files are never copied into memory as a whole.
+    """
+
+    tensor_hash = hashlib.sha256()
+    tensor_hash.update(str((tensor.shape, tensor.dtype.str)).encode())
+    for t in range(tensor.shape[2]):
+        tensor_hash.update(
+            np.ascontiguousarray(tensor[:, :, t]).tobytes()
+        )
+
+    return tensor_hash.hexdigest()
+
+
+def find_bundle_content_hash(
+    path_to_bundle,
+    name,
+    array
+):
+
+    """ Returns the content hash of the bundle in path_to_bundle if array 
+    is its read-only memory-mapped array name, e.g. as returned by
+    prep_ubermovement.create_city_bundle(), so that the content of array is
+    known without reading it. Returns None otherwise.
+    """
+
+    manifest = read_manifest(path_to_bundle)
+    if manifest is None or name not in manifest['arrays']:
+        return None
+    if not isinstance(array, np.memmap) or array.flags.writeable:
+        return None
+    if array.filename is None or not os.path.isfile(array.filename):
+        return None
+
+    entry = manifest['arrays'][name]
+    if (
+        list(array.shape) != entry['shape']
+        or not os.path.samefile(
+            array.filename,
+            os.path.join(
+                path_to_bundle,
+                entry['file']
+            )
+        )
+    ):
+        return None
+
+    return manifest['content_hash']
+
+
+def read_manifest(path_to_bundle):
+
+    """ Returns the manifest of the bundle in path_to_bundle as dictionary,
+    or None if there is no bundle of the current BUNDLE_VERSION. """
+
+    if path_to_bundle is None:
+        return None
+
+    path_to_manifest = os.path.join(
+        path_to_bundle,
+        MANIFEST_FILE_NAME
+    )
+    if not os.path.isfile(path_to_manifest):
+        return None
+
+    with open(path_to_manifest) as file:
+        manifest = json.load(file)
+
+    if manifest.get('version') != BUNDLE_VERSION:
+        return None
+
+    return manifest
+
+
+def write_manifest(
+    path_to_bundle,
+    manifest
+):
+
+    """ Writes the manifest of a bundle. The file is replaced atomically, so
+    that readers never see a partially written manifest. """
+
+    path_to_manifest = os.path.join(
+        path_to_bundle,
+        MANIFEST_FILE_NAME
+    )
+    with open(path_to_manifest + '.tmp', 'w') as file:
+        json.dump(
+            manifest,
+            file,
+            indent=2,
+            default=str
+        )
+    os.replace(
+        path_to_manifest + '.tmp',
+        path_to_manifest
+    )
+
+
+def save_bundle_arrays(
+    path_to_bundle,
+    array_dict,
+    content_hash=None,
+    parameters=None,
+    file_dict=None
+):
+
+    """ Saves each array of array_dict as raw .npy file in path_to_bundle and
+    lists it in the manifest together with parameters, which describe how
+    the arrays were created. Arrays are written in blocks with 
+    write_array_blocks(), so that arrays backed by files are never copied 
+    into memory as a whole. If content_hash is passed and differs from the
+    hash of the existing bundle, the stale bundle is removed first. Without
+    content_hash, arrays are added to the existing bundle. Returns False if
+    there is no bundle to add arrays to.
+    """
+
+    manifest = read_manifest(path_to_bundle)
+
+    if content_hash is not None:
+        # remove stale arrays of a bundle with other content
+        if manifest is not None and manifest['content_hash'] != content_hash:
+            for entry in manifest['arrays'].values():
+                path_to_array = os.path.join(
+                    path_to_bundle,
+                    entry['file']
+                )
+                if os.path.isfile(path_to_array):
+                    os.remove(path_to_array)
+            manifest = None
+
+        if manifest is None:
+            manifest = {
+                'version': BUNDLE_VERSION,
+                'content_hash': content_hash,
+                'source_files': file_dict or {},
+                'arrays': {}
+            }
+
+    elif manifest is None:
+        return False
+
+    os.makedirs(
+        path_to_bundle,
+        exist_ok=True
+    )
+
+    for name, array in array_dict.items():
+        array = np.asarray(array)
+        file_name = name + '.npy'
+        path_to_array = os.path.join(
+            path_to_bundle,
+            file_name
+        )
+        # replace files atomically, so that arrays which are memory-mapped
+        # by other traffic systems keep their content
+        with open(path_to_array + '.tmp', 'wb') as file:
+            write_array_blocks(
+                file,
+                array
+            )
+        os.replace(
+            path_to_array + '.tmp',
+            path_to_array
+        )
+        manifest['arrays'][name] = {
+            'file': file_name,
+            'shape': list(array.shape),
+            'dtype': array.dtype.str,
+            'parameters': parameters or {}
+        }
+
+    # manifest is written last, so that it only lists complete arrays
+    write_manifest(
+        path_to_bundle,
+        manifest
+    )
+
+    return True
+
+
+def write_array_blocks(
+    file,
+    array,
+    block_size=2**26
+):
+
+    """ Writes array to the open binary file in .npy format, one block of
+    rows along the first axis of about block_size bytes at a time. Unlike 
+    numpy.save(), this reads time-major memory-mapped tensors in large 
+    contiguous pieces and keeps peak memory at one block.
+    """
+
+    np.lib.format.write_array_header_1_0(
+        file,
+        {
+            'descr': np.lib.format.dtype_to_descr(array.dtype),
+            'fortran_order': False,
+            'shape': array.shape
+        }
+    )
+
+    # scalar arrays are written as a single row
+    rows = np.atleast_1d(array)
+    block_rows = max(block_size // max(rows[:1].nbytes, 1), 1)
+    for first_row in range(0, len(rows), block_rows):
+        file.write(
+            np.ascontiguousarray(
+                rows[first_row:first_row + block_rows]
+            ).tobytes()
+        )
+
+
+def load_bundle_arrays(
+    path_to_bundle,
+    name_list,
+    content_hash=None,
+    parameters=None,
+    mmap_mode='r'
+):
+
+    """ Loads the arrays of name_list from path_to_bundle as memory-mapped
+    arrays with mmap_mode, so that loading takes constant time independent
+    of the array size. Returns a dictionary of arrays, or None if the
+    bundle does not exist, its content_hash differs, or any array is missing
+    or was saved with other parameters.
+    """
+
+    manifest = read_manifest(path_to_bundle)
+    if manifest is None:
+        return None
+    if content_hash is not None and manifest['content_hash'] != content_hash:
+        return None
+
+    array_dict = {}
+    for name in name_list:
+        entry = manifest['arrays'].get(name)
+        if entry is None or entry['parameters'] != json.loads(
+            json.dumps(
+                parameters or {},
+                sort_keys=True,
+                default=str
+            )
+        ):
+            return None
+
+        array_dict[name] = np.load(
+            os.path.join(
+                path_to_bundle,
+                entry['file']
+            ),
+            mmap_mode=mmap_mode
+        )
+
+    return array_dict
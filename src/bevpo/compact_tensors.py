@@ -0,0 +1,117 @@
+import numpy as np
+
+
+def zone_index_dtype(number_zones):
+
+    """ Returns the smallest signed integer type that can index all city
+    zones.
+    """
+
+    if number_zones <= np.iinfo(np.int16).max + 1:
+        return np.int16
+    else:
+        return np.int32
+
+
+class CompactTransitionTensor:
+
+    """ Stores the C x T x 4 transition tensor of the traffic system as
+    separate arrays per component: a boolean driving mask, integer
+    destinations sized to the number of city zones and float32 travel times
+    and distances. Indexing with [cars, t, k] reads from and writes to the
+    respective component arrays, so that code written for the dense
+    transition tensor keeps working.
+    """
+
+    def __init__(
+        self,
+        C,
+        T,
+        number_zones
+    ):
+
+        self.drive = np.zeros(
+            (
+                C,
+                T
+            ),
+            dtype=bool
+        )
+        self.destination = np.zeros(
+            (
+                C,
+                T
+            ),
+            dtype=zone_index_dtype(number_zones)
+        )
+        self.travel_time = np.zeros(
+            (
+                C,
+                T
+            ),
+            dtype=np.float32
+        )
+        self.travel_distance = np.zeros(
+            (
+                C,
+                T
+            ),
+            dtype=np.float32
+        )
+
+        # driving x destination x travel time x distance
+        self.components = (
+            self.drive,
+            self.destination,
+            self.travel_time,
+            self.travel_distance
+        )
+        self.shape = (
+            C,
+            T,
+            len(self.components)
+        )
+
+
+    def __getitem__(self, key):
+
+        """ Returns the component array entries of key = (cars, t, k). If k
+        selects several components, these are stacked along a last axis as
+        float values like in the dense transition tensor.
+        """
+
+        car_key, time_key, component_key = key
+
+        if isinstance(component_key, (int, np.integer)):
+            return self.components[component_key][car_key, time_key]
+
+        component_list = range(len(self.components))[component_key]
+
+        return np.stack(
+            [
+                self.components[k][car_key, time_key].astype(float)
+                for k in component_list
+            ],
+            axis=-1
+        )
+
+
+    def __setitem__(self, key, value):
+
+        """ Writes value to the component array entries of key =
+        (cars, t, k). """
+
+        car_key, time_key, component_key = key
+
+        if isinstance(component_key, (int, np.integer)):
+            self.components[component_key][car_key, time_key] = value
+
+        else:
+            value = np.asarray(value)
+            component_list = range(len(self.components))[component_key]
+
+            for position, k in enumerate(component_list):
+                if value.ndim == 0:
+                    self.components[k][car_key, time_key] = value
+                else:
+                    self.components[k][car_key, time_key] = value[..., position]
@@ -1,6 +1,45 @@
+import bevpo.city_bundle as city_bundle
+import bevpo.memmap_tensors as memmap_tensors
+
 import pandas as pd
 import numpy as np
 import math
+import itertools
+import os
+import shutil
+
+
+# columns of Uber Movement travel time csv files with narrow data types
+RAWDATA_DTYPES = {
+    'sourceid': np.int32,
+    'dstid': np.int32,
+    'mean_travel_time': np.float32,
+    'standard_deviation_travel_time': np.float32
+}
+
+# time values of the time keys in which Uber Movement aggregates travel times
+TIME_KEY_VALUES = {
+    'hod': list(range(24)),
+    'dow': list(range(1, 8)),
+    'month': list(range(1, 13))
+}
+
+
+def normalize_time_key(time_key):
+
+    """ Returns time_key as a single column name if it is a string or a 
+    list of one column, and as a list of column names otherwise, so that 
+    'hod' and ['hod'] result in the same time steps.
+    """
+
+    if isinstance(time_key, str):
+        return time_key
+
+    time_key = list(time_key)
+    if len(time_key) == 1:
+        return time_key[0]
+
+    return time_key
 
 def create_city_zone_coordinates(path_to_json_data):
 
@@ -261,13 +300,20 @@ def calc_centroids(
     return map_movement_id_to_centroid_coordinates
     
 
-def create_od_matrix_lists(path_to_rawdata):
+def create_od_matrix_lists(
+    path_to_rawdata,
+    time_key='hod'
+):
 
     """ imports the raw Uber Movement travel time data and creates tw0 lists of
     origin destination (OD) matrices. A first list contains the mean travel time
     and a distinct second list contains the standard deviation of travel time. 
     Each matrix and therefore each list element corresponds to a single time 
-    step. 
+    step. time_key is the column of time values, e.g. 'hod', 'dow' or 'month',
+    or a list of columns for combined time steps such as ['dow', 'hod'] for
+    the 168 hours of a week. Rows are split by time value in a single 
+    groupby pass, and time steps are ordered as returned by 
+    create_time_values().
     """
     
     rename_dict_mean = {
@@ -281,20 +327,35 @@ def create_od_matrix_lists(path_to_rawdata):
         'standard_deviation_travel_time': 'stddev_travel_time'
     }
     
+    time_key = normalize_time_key(time_key)
     travel_data = pd.read_csv(path_to_rawdata)
     od_mean_travel_time_list = []
     od_std_travel_time_list = []
 
-    T = 24
-    for t in range(T):
-        hod_travel_data = travel_data.loc[travel_data['hod'] == t]
+    # split rows by time value in one pass
+    time_data_dict = dict(
+        list(
+            travel_data.groupby(time_key)
+        )
+    )
+    time_values = create_time_values(
+        time_key,
+        time_data_dict.keys()
+    )
+
+    for time_value in time_values:
+        # time steps without data result in empty matrices
+        time_travel_data = time_data_dict.get(
+            time_value,
+            travel_data.iloc[:0]
+        )
         od_mean_travel_time_list.append(
-            hod_travel_data[
+            time_travel_data[
                 ['sourceid', 'dstid','mean_travel_time']
             ].rename(columns=rename_dict_mean)
         )
         od_std_travel_time_list.append(
-            hod_travel_data[
+            time_travel_data[
                 ['sourceid', 'dstid','standard_deviation_travel_time']
             ].rename(columns=rename_dict_stddev)
         )
@@ -306,3 +367,295 @@ def create_od_matrix_lists(path_to_rawdata):
     )
     
     return od_travel_time_lists
+
+
+def create_time_values(
+    time_key='hod',
+    found_time_values=None
+):
+
+    """ Returns the list of time values that correspond to the time steps of
+    time_key. For time keys of TIME_KEY_VALUES, these are all possible 
+    values, so that the number of time steps does not depend on which values
+    appear in the data. Combined time keys result in tuples of all 
+    combinations, e.g. (dow, hod) for ['dow', 'hod']. For other time keys, 
+    these are the sorted distinct found_time_values.
+    """
+
+    time_key = normalize_time_key(time_key)
+    if isinstance(time_key, str):
+        if time_key in TIME_KEY_VALUES:
+            return TIME_KEY_VALUES[time_key]
+    
+    elif all(key in TIME_KEY_VALUES for key in time_key):
+        return list(
+            itertools.product(
+                *[TIME_KEY_VALUES[key] for key in time_key]
+            )
+        )
+
+    return sorted(found_time_values)
+
+
+def create_od_datatensors(
+    path_to_rawdata,
+    city_zone_coordinates,
+    time_key='hod',
+    chunksize=1000000,
+    dtype=np.float64,
+    path_to_memmap=None
+):
+
+    """ Reads the raw Uber Movement travel time data in chunks of chunksize 
+    rows and scatters the mean and standard deviation of travel time 
+    straight into two number_zones x number_zones x T datatensors. Only the
+    columns of RAWDATA_DTYPES and time_key are read, with narrow data types.
+    City zone indexing corresponds to respective index positions in 
+    city_zone_coordinates.index and time step indexing to the position of 
+    the time value in create_time_values(). time_key is a column or list of
+    columns like in create_od_matrix_lists(). Rows with unknown zone IDs or
+    time values are skipped. The datatensors can be passed to TrafficSystem
+    instead of lists of OD matrices, so that neither the whole csv file nor
+    intermediate DataFrames per time step are kept in memory. If 
+    path_to_memmap is set, the datatensors are backed by time-major 
+    numpy.memmap files in a new subdirectory of path_to_memmap instead of 
+    RAM, see memmap_tensors.create_memmap_tensor().
+    """
+
+    time_key = normalize_time_key(time_key)
+    if isinstance(time_key, str):
+        time_key_list = [time_key]
+    else:
+        time_key_list = list(time_key)
+
+    # read time keys with narrow data types if their values are known
+    rawdata_dtypes = dict(RAWDATA_DTYPES)
+    for key in time_key_list:
+        if key in TIME_KEY_VALUES:
+            rawdata_dtypes[key] = np.int8
+
+    # distinct values of unknown time keys are found in a first pass over 
+    # the time key columns only
+    found_time_values = set()
+    if not all(key in TIME_KEY_VALUES for key in time_key_list):
+        for time_data in pd.read_csv(
+            path_to_rawdata,
+            usecols=time_key_list,
+            chunksize=chunksize
+        ):
+            if len(time_key_list) > 1:
+                found_time_values.update(
+                    time_data[time_key_list].drop_duplicates().itertuples(
+                        index=False,
+                        name=None
+                    )
+                )
+            else:
+                found_time_values.update(
+                    time_data[time_key_list[0]].unique()
+                )
+
+    # map time values and zone IDs to their index positions
+    time_value_lookup = pd.Index(
+        create_time_values(
+            time_key,
+            found_time_values
+        )
+    )
+    zone_id_lookup = pd.Index(city_zone_coordinates.index.values)
+    number_zones = len(zone_id_lookup)
+    T = len(time_value_lookup)
+
+    if path_to_memmap is None:
+        datatensor_mean = np.zeros(
+            (
+                number_zones,
+                number_zones,
+                T
+            ),
+            dtype=dtype
+        )
+        datatensor_stddev = np.zeros(
+            (
+                number_zones,
+                number_zones,
+                T
+            ),
+            dtype=dtype
+        )
+    else:
+        memmap_directory = memmap_tensors.create_memmap_directory(
+            path_to_memmap
+        )
+        datatensor_mean = memmap_tensors.create_memmap_tensor(
+            os.path.join(
+                memmap_directory,
+                'datatensor_mean.dat'
+            ),
+            number_zones,
+            T,
+            dtype
+        )
+        datatensor_stddev = memmap_tensors.create_memmap_tensor(
+            os.path.join(
+                memmap_directory,
+                'datatensor_stddev.dat'
+            ),
+            number_zones,
+            T,
+            dtype
+        )
+
+    # iterate over chunks of csv file
+    for travel_data in pd.read_csv(
+        path_to_rawdata,
+        usecols=list(RAWDATA_DTYPES) + time_key_list,
+        dtype=rawdata_dtypes,
+        chunksize=chunksize
+    ):
+        # get positions of source and destination zones and time steps of 
+        # all rows
+        source = zone_id_lookup.get_indexer(travel_data['sourceid'].values)
+        dest = zone_id_lookup.get_indexer(travel_data['dstid'].values)
+        if len(time_key_list) > 1:
+            time = time_value_lookup.get_indexer(
+                pd.MultiIndex.from_frame(travel_data[time_key_list])
+            )
+        else:
+            time = time_value_lookup.get_indexer(
+                travel_data[time_key_list[0]].values
+            )
+
+        # skip rows whose zone IDs or time values are unknown
+        known = (
+            (source >= 0)
+            & (dest >= 0)
+            & (time >= 0)
+        )
+        source = source[known]
+        dest = dest[known]
+        time = time[known]
+
+        # assign all values of current chunk at once
+        datatensor_mean[source, dest, time] = (
+            travel_data['mean_travel_time'].values[known]
+        )
+        datatensor_stddev[source, dest, time] = (
+            travel_data['standard_deviation_travel_time'].values[known]
+        )
+
+    datatensors = (
+        datatensor_mean,
+        datatensor_stddev
+    )
+
+    return datatensors
+
+
+def create_city_bundle(
+    path_to_json_data,
+    path_to_rawdata,
+    path_to_bundle,
+    time_key='hod',
+    chunksize=1000000,
+    mmap_mode='r'
+):
+
+    """ Returns city_zone_coordinates and the mean and standard deviation 
+    datatensors of an Uber Movement city from the bundle in path_to_bundle.
+    The bundle is keyed by a content hash of the json and csv files and 
+    time_key. If it does not exist or is stale, it is created from the 
+    source files with create_city_zone_coordinates() and 
+    create_od_datatensors() first, with datatensors backed by temporary 
+    files in path_to_bundle, so that peak memory does not grow with the 
+    size of the datatensors. Datatensors are loaded as memory-mapped
+    arrays with mmap_mode. Passing path_to_bundle to TrafficSystem 
+    additionally caches od distances and probability distributions in the 
+    same bundle.
+    """
+
+    time_key = normalize_time_key(time_key)
+    content_hash, file_dict = city_bundle.calc_content_hash(
+        [
+            path_to_json_data,
+            path_to_rawdata
+        ],
+        {
+            'time_key': time_key
+        },
+        path_to_bundle
+    )
+    name_list = [
+        'zone_id',
+        'zone_lat',
+        'zone_long',
+        'datatensor_mean',
+        'datatensor_stddev'
+    ]
+
+    array_dict = city_bundle.load_bundle_arrays(
+        path_to_bundle,
+        name_list,
+        content_hash,
+        mmap_mode=mmap_mode
+    )
+
+    # create bundle from source files if it does not exist or is stale
+    if array_dict is None:
+        city_zone_coordinates = create_city_zone_coordinates(path_to_json_data)
+
+        # datatensors are scattered into temporary files in the bundle, so 
+        # that they never have to fit into memory
+        (
+            datatensor_mean,
+            datatensor_stddev
+        ) = create_od_datatensors(
+            path_to_rawdata,
+            city_zone_coordinates,
+            time_key,
+            chunksize,
+            path_to_memmap=path_to_bundle
+        )
+        memmap_directory = os.path.dirname(datatensor_mean.filename)
+        try:
+            city_bundle.save_bundle_arrays(
+                path_to_bundle,
+                {
+                    'zone_id': city_zone_coordinates.index.values,
+                    'zone_lat': city_zone_coordinates['zone_lat'].values,
+                    'zone_long': city_zone_coordinates['zone_long'].values,
+                    'datatensor_mean': datatensor_mean,
+                    'datatensor_stddev': datatensor_stddev
+                },
+                content_hash,
+                file_dict=file_dict
+            )
+        finally:
+            del datatensor_mean, datatensor_stddev
+            shutil.rmtree(memmap_directory)
+        array_dict = city_bundle.load_bundle_arrays(
+            path_to_bundle,
+            name_list,
+            content_hash,
+            mmap_mode=mmap_mode
+        )
+
+    # create a pandas Dataframe in required format for bevpo
+    city_zone_coordinates = pd.DataFrame(
+        {
+            'zone_lat': np.array(array_dict['zone_lat']),
+            'zone_long': np.array(array_dict['zone_long'])
+        },
+        index=pd.Index(
+            np.array(array_dict['zone_id']),
+            name='zone_id'
+        )
+    )
+
+    city_bundle_data = (
+        city_zone_coordinates,
+        array_dict['datatensor_mean'],
+        array_dict['datatensor_stddev']
+    )
+
+    return city_bundle_data
@@ -0,0 +1,205 @@
+import bevpo.prob_dist as prob_dist
+import bevpo.shared_tables as shared_tables
+
+import copy
+import concurrent.futures
+import numpy as np
+
+
+# results of each replication that are summarized over the ensemble
+ENSEMBLE_RESULTS = (
+    'driving_map',
+    'parking_map',
+    'charging_map'
+)
+
+# traffic system and attached shared memory blocks of each worker process
+worker_traffic_system = None
+worker_shared_memory_list = []
+
+
+def simulate_ensemble(
+    tfs,
+    replications,
+    mode='cars',
+    max_workers=None,
+    percentiles=(5, 50, 95)
+):
+
+    """ Simulates replications independent days of the traffic system in a 
+    pool of max_workers processes. Datatensors and distributions are created
+    once and published in shared memory, to which each worker process 
+    attaches on start-up without copying. Every replication
+    draws from its own random number stream spawned from tfs.rng, so that 
+    results are reproducible for a fixed seed independent of the number of
+    workers. Per-zone means and variances of the maps are updated as 
+    replications finish and percentiles are calculated from all replications
+    at the end.
+    """
+
+    # transform data and calculate distributions once for all replications
+    tfs.create_datatensors()
+    prob_dist.calc_prob_dists(tfs)
+
+    # one independent random number stream per replication
+    rng_list = tfs.rng.spawn(replications)
+
+    ensemble_mean = {}
+    ensemble_sum_squares = {}
+    ensemble_samples = {}
+    finished_results = {}
+    number_reduced = 0
+
+    # publish distributions and datatensors in shared memory
+    with shared_tables.publish_shared_tables(tfs) as (table_specs, _):
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_ensemble_worker,
+            initargs=(
+                create_worker_traffic_system(
+                    tfs,
+                    table_specs
+                ),
+                table_specs
+            )
+        ) as executor:
+            future_dict = {
+                executor.submit(
+                    simulate_replication,
+                    mode,
+                    rng
+                ): replication
+                for replication, rng in enumerate(rng_list)
+            }
+
+            for future in concurrent.futures.as_completed(future_dict):
+                finished_results[future_dict[future]] = future.result()
+
+                # reduce finished replications in their order, so that results
+                # do not depend on the order in which workers finish
+                while number_reduced in finished_results:
+                    result_dict = finished_results.pop(number_reduced)
+                    number_reduced += 1
+
+                    update_ensemble_statistics(
+                        result_dict,
+                        number_reduced,
+                        replications,
+                        ensemble_mean,
+                        ensemble_sum_squares,
+                        ensemble_samples
+                    )
+
+    # save results to class object attributes
+    tfs.ensemble_mean = ensemble_mean
+    tfs.ensemble_variance = {
+        name: ensemble_sum_squares[name] / max(replications - 1, 1)
+        for name in ensemble_sum_squares
+    }
+    tfs.ensemble_percentiles = {
+        name: np.percentile(
+            ensemble_samples[name],
+            percentiles,
+            axis=0
+        )
+        for name in ensemble_samples
+    }
+
+    # set distributions to zero for saving memory
+    tfs.p_drive = 0
+    tfs.p_dest = 0
+    tfs.p_joint = 0
+
+
+def update_ensemble_statistics(
+    result_dict,
+    number_reduced,
+    replications,
+    ensemble_mean,
+    ensemble_sum_squares,
+    ensemble_samples
+):
+
+    """ Updates the running means and sums of squared deviations of all 
+    results in result_dict with Welford's method, after number_reduced 
+    replications including the current one, and stores the results for 
+    calculating percentiles.
+    """
+
+    for name, result in result_dict.items():
+        if name not in ensemble_mean:
+            ensemble_mean[name] = np.zeros(result.shape)
+            ensemble_sum_squares[name] = np.zeros(result.shape)
+            ensemble_samples[name] = np.zeros(
+                (replications,) + result.shape
+            )
+
+        delta = result - ensemble_mean[name]
+        ensemble_mean[name] += delta / number_reduced
+        ensemble_sum_squares[name] += delta * (
+            result - ensemble_mean[name]
+        )
+        ensemble_samples[name][number_reduced - 1] = result
+
+
+def create_worker_traffic_system(
+    tfs,
+    table_specs
+):
+
+    """ Returns a shallow copy of tfs without per-car tensors and without the
+    tables published in table_specs, which is sent to every worker process
+    once.
+    """
+
+    worker_tfs = shared_tables.create_unshared_copy(
+        tfs,
+        table_specs
+    )
+    worker_tfs.state_tensor = 0
+    worker_tfs.transition_tensor = 0
+    worker_tfs.rng = 0
+
+    return worker_tfs
+
+
+def init_ensemble_worker(
+    worker_tfs,
+    table_specs
+):
+
+    """ Attaches the traffic system passed on start-up of a worker process to
+    the shared memory blocks of table_specs and keeps it for all 
+    replications that are run by this worker.
+    """
+
+    global worker_traffic_system, worker_shared_memory_list
+    worker_shared_memory_list = shared_tables.attach_shared_tables(
+        worker_tfs,
+        table_specs
+    )
+    worker_traffic_system = worker_tfs
+
+
+def simulate_replication(
+    mode,
+    rng
+):
+
+    """ Simulates one replication on a shallow copy of the worker traffic 
+    system with its own per-car tensors and random number generator. Returns
+    a dictionary of the results named in ENSEMBLE_RESULTS.
+    """
+
+    replication_tfs = copy.copy(worker_traffic_system)
+    replication_tfs.rng = rng
+    replication_tfs.create_car_tensors()
+    replication_tfs.sample_traffic_system(mode)
+
+    # charging results are only available if a charging profile is passed
+    return {
+        name: np.asarray(getattr(replication_tfs, name), dtype=float)
+        for name in ENSEMBLE_RESULTS
+        if not isinstance(getattr(replication_tfs, name), int)
+    }
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import numpy as np
+
+
+def create_tensor(
+    tfs,
+    name,
+    dtype=np.float64
+):
+
+    """ Returns a number_zones x number_zones x T tensor of zeros. If
+    tfs.path_to_memmap is set, the tensor is backed by the numpy.memmap file
+    name.dat in the memmap directory of tfs instead of RAM, see
+    create_memmap_tensor(). Each traffic system writes into its own new
+    subdirectory of path_to_memmap, so that traffic systems sharing
+    path_to_memmap never overwrite files that another one has mapped.
+    """
+
+    if tfs.path_to_memmap is None:
+        return np.zeros(
+            (
+                tfs.number_zones,
+                tfs.number_zones,
+                tfs.T
+            ),
+            dtype=dtype
+        )
+
+    if tfs.memmap_directory is None:
+        tfs.memmap_directory = create_memmap_directory(tfs.path_to_memmap)
+
+    return create_memmap_tensor(
+        os.path.join(
+            tfs.memmap_directory,
+            name + '.dat'
+        ),
+        tfs.number_zones,
+        tfs.T,
+        dtype
+    )
+
+
+def create_memmap_directory(path_to_memmap):
+
+    """ Creates and returns a new uniquely named subdirectory of
+    path_to_memmap for the memmap files of one traffic system or datatensor
+    import. Files are not removed when they are no longer used.
+    """
+
+    os.makedirs(
+        path_to_memmap,
+        exist_ok=True
+    )
+
+    return tempfile.mkdtemp(
+        prefix='bevpo_',
+        dir=path_to_memmap
+    )
+
+
+def create_memmap_tensor(
+    path_to_file,
+    number_zones,
+    T,
+    dtype=np.float64
+):
+
+    """ Returns a number_zones x number_zones x T tensor of zeros that is
+    backed by the new numpy.memmap file path_to_file. The file is stored
+    time-major, i.e. as T x number_zones x number_zones, so that each
+    [:, :, t] slice is a contiguous block that is read sequentially. The
+    returned array is a transposed view in the usual axis order, so that
+    indexing does not change.
+    """
+
+    tensor = np.memmap(
+        path_to_file,
+        dtype=dtype,
+        mode='w+',
+        shape=(
+            T,
+            number_zones,
+            number_zones
+        )
+    )
+
+    return tensor.transpose(1, 2, 0)
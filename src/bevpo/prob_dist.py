@@ -1,15 +1,63 @@
+import bevpo.compact_tensors as compact_tensors
+import bevpo.city_bundle as city_bundle
+import bevpo.memmap_tensors as memmap_tensors
+import bevpo.sparse_tensors as sparse_tensors
+
 import numpy as np
 
 def calc_prob_dists(tfs):
 
     """ calculates the probabilities of driving p_drive and choosing a 
-    destination p_dest.
+    destination p_dest. If tfs.bundle_prob_dists is True, both are loaded
+    from the city bundle in tfs.path_to_bundle when they are cached for the
+    same parameters, and cached there otherwise. If tfs.sparse_od is True,
+    p_dest is calculated on the sparse datatensor and not cached.
     """
 
+    if tfs.sparse_od and tfs.destination_sampling == 'alias':
+        raise ValueError(
+            'alias tables are not available for sparse_od=True, use '
+            'destination_sampling=\'inverse_cdf\' instead'
+        )
 
-    create_distribution_p_drive(tfs)
-    create_distribution_p_dest(tfs)
-    #create_distribution_p_joint(tfs)
+    if tfs.bundle_prob_dists and not tfs.sparse_od:
+        bundle_parameters = tfs.create_bundle_parameters(datatensors=True)
+        bundle_arrays = city_bundle.load_bundle_arrays(
+            tfs.path_to_bundle,
+            ['p_drive', 'p_dest'],
+            parameters=bundle_parameters
+        )
+    else:
+        bundle_arrays = None
+
+    if bundle_arrays is not None:
+        tfs.p_drive = bundle_arrays['p_drive']
+        tfs.p_dest = bundle_arrays['p_dest']
+    else:
+        create_distribution_p_drive(tfs)
+        
+        # large tensors backed by files are processed one time slice at a time
+        if tfs.sparse_od:
+            create_sparse_distribution_p_dest(tfs)
+        elif tfs.path_to_memmap is None:
+            create_distribution_p_dest(tfs)
+        else:
+            create_distribution_p_dest_by_time_slice(tfs)
+        #create_distribution_p_joint(tfs)
+        
+        if tfs.bundle_prob_dists and not tfs.sparse_od:
+            city_bundle.save_bundle_arrays(
+                tfs.path_to_bundle,
+                {
+                    'p_drive': tfs.p_drive,
+                    'p_dest': tfs.p_dest
+                },
+                parameters=bundle_parameters
+            )
+    
+    # alias tables for constant time destination sampling if requested
+    if tfs.destination_sampling == 'alias':
+        create_alias_tables_p_dest(tfs)
 
 
 def create_distribution_p_drive(tfs):
@@ -20,67 +68,89 @@ def create_distribution_p_drive(tfs):
     city_zone_coordinates.index array.
     """
 
-    p_drive = np.zeros(
+    ratio_sum = np.zeros(
         (
             tfs.number_zones,
             tfs.T
         )
     )
-    mean_sum = np.zeros(
+    counter = np.zeros(
         (
             tfs.number_zones,
             tfs.T
         )
     )
-    min_t = np.zeros(
+    ratio_t = np.zeros(
         (
+            tfs.number_zones,
             tfs.number_zones
         )
     )
-    max_t = np.zeros(
+    # sum travel time per distance over all destinations with available
+    # travel times, one time step at a time
+    for time in range(tfs.T):
+        # sparse datatensors only store available travel times
+        if isinstance(tfs.datatensor_mean, sparse_tensors.SparseODTensor):
+            source = tfs.datatensor_mean.row_ids(time)
+            dest = tfs.datatensor_mean.indices[time]
+            ratio_sum[:, time] = np.bincount(
+                source,
+                weights=(
+                    tfs.datatensor_mean.data[time]
+                    / tfs.od_distances_array[source, dest]
+                ),
+                minlength=tfs.number_zones
+            )
+            counter[:, time] = np.diff(tfs.datatensor_mean.indptr[time])
+            continue
+
+        mean_t = tfs.datatensor_mean[:, :, time]
+        dest_mask = mean_t > 0
+        ratio_t.fill(0)
+        np.divide(
+            mean_t,
+            tfs.od_distances_array,
+            out=ratio_t,
+            where=dest_mask
+        )
+        ratio_sum[:, time] = np.sum(ratio_t, axis=1)
+        counter[:, time] = np.count_nonzero(dest_mask, axis=1)
+
+    # mean travel time per distance for each source and time step
+    mean_sum = np.zeros(
         (
-            tfs.number_zones
+            tfs.number_zones,
+            tfs.T
         )
     )
-    for source in range(tfs.number_zones):
-
-        for time in range(tfs.T):
-            mean_sum_term = 0
-            counter = 0
-
-            for dest in range(tfs.number_zones):
-                if tfs.datatensor_mean[source, dest, time] > 0:
-                    counter += 1
-                    mean_sum_term = (
-                        mean_sum_term
-                        + tfs.datatensor_mean[source, dest, time] / (
-                            tfs.od_distances.iloc[source, dest]
-                        )
-                    )
-
-            if counter > 0:
-                mean_sum[source, time] = mean_sum_term / counter
-
-        value_array = mean_sum[source, :]
-        min_t[source] = np.amin(value_array)
-        max_t[source] = np.amax(value_array)
-
-    for source in range(tfs.number_zones):
-        if max_t[source] >0:
-
-            for time in range(tfs.T):
-                if mean_sum[source, time] > 0:
-                    value = (
-                        tfs.p_min
-                        + (tfs.p_max - tfs.p_min) * (
-                            (mean_sum[source, time] - min_t[source]) /
-                            (max_t[source] - min_t[source])
-                        )**tfs.e_drive
-                    )
-                else:
-                    value = 0
+    np.divide(
+        ratio_sum,
+        counter,
+        out=mean_sum,
+        where=counter > 0
+    )
+    min_t = np.amin(mean_sum, axis=1, keepdims=True)
+    max_t = np.amax(mean_sum, axis=1, keepdims=True)
 
-                p_drive[source, time] = value
+    # min-max scale over time steps. Zones with constant values over time
+    # are assigned the lower bound p_min
+    scaled_sum = np.zeros(
+        (
+            tfs.number_zones,
+            tfs.T
+        )
+    )
+    np.divide(
+        mean_sum - min_t,
+        max_t - min_t,
+        out=scaled_sum,
+        where=max_t > min_t
+    )
+    p_drive = np.where(
+        (max_t > 0) & (mean_sum > 0),
+        tfs.p_min + (tfs.p_max - tfs.p_min) * scaled_sum**tfs.e_drive,
+        0
+    )
 
     tfs.p_drive = p_drive
 
@@ -89,81 +159,348 @@ def create_distribution_p_dest(tfs):
 
     """ Calculates probability distributions of choosing a destination.
     Note that city zones correspond to positions in datatensor and not 
-    the origional IDs from the city_zone_coordinates.index array.
+    the origional IDs from the city_zone_coordinates.index array. Min-max
+    values over time are found on the whole datatensor, and each time slice
+    is scaled and normalized by scale_distribution_p_dest().
     """
 
-    p_dest = np.zeros(
+    # min-max values of each origin destination pair over time
+    max_x = np.amax(tfs.datatensor_mean, axis=2)
+    min_x = np.amin(tfs.datatensor_mean, axis=2)
+    
+    p_dest = np.empty(
         (
             tfs.number_zones,
             tfs.number_zones,
             tfs.T
         )
     )
-    min_x = np.zeros(
-        (
-            tfs.number_zones,
-            tfs.number_zones
-        )
+    scale_distribution_p_dest(
+        tfs,
+        p_dest,
+        max_x,
+        min_x
+    )
+
+    tfs.p_dest = p_dest
+
+
+def create_distribution_p_dest_by_time_slice(tfs):
+
+    """ Calculates the same probability distributions of choosing a 
+    destination as create_distribution_p_dest(), but reads datatensor_mean
+    and writes p_dest one time slice at a time. A first pass finds the 
+    min-max values of each origin destination pair over time, a second pass
+    scales and normalizes each slice. Peak memory is a few number_zones x 
+    number_zones slices, so that p_dest can be backed by a file in 
+    tfs.path_to_memmap.
+    """
+
+    # min-max values of each origin destination pair over time
+    max_x = np.array(tfs.datatensor_mean[:, :, 0])
+    min_x = max_x.copy()
+    for time in range(1, tfs.T):
+        mean_t = tfs.datatensor_mean[:, :, time]
+        np.maximum(max_x, mean_t, out=max_x)
+        np.minimum(min_x, mean_t, out=min_x)
+
+    p_dest = memmap_tensors.create_tensor(
+        tfs,
+        'p_dest'
+    )
+    scale_distribution_p_dest(
+        tfs,
+        p_dest,
+        max_x,
+        min_x
+    )
+
+    tfs.p_dest = p_dest
+
+
+def scale_distribution_p_dest(
+    tfs,
+    p_dest,
+    max_x,
+    min_x
+):
+
+    """ Writes the probability distributions of choosing a destination into
+    p_dest one time slice at a time. Mean travel times are min-max scaled 
+    over time with the min-max values max_x and min_x of each origin 
+    destination pair, raised to the power of e_dest and normalized over 
+    destinations. Works on a single number_zones x number_zones buffer.
+    """
+
+    range_x = max_x - min_x
+
+    # only pairs with travel times that change over time are scaled. Pairs
+    # without travel times or with constant travel times get zero weight
+    scale_mask = (
+        (max_x > 0)
+        & (max_x > min_x)
     )
-    max_x = np.zeros(
+
+    p_dest_t = np.empty(
         (
             tfs.number_zones,
             tfs.number_zones
         )
     )
-    normalization_factor = np.zeros(
-        (
-            tfs.number_zones,
-            tfs.T
+    for time in range(tfs.T):
+        # min-max scale and raise to the power of e_dest in place
+        np.subtract(
+            tfs.datatensor_mean[:, :, time],
+            min_x,
+            out=p_dest_t
+        )
+        np.divide(
+            p_dest_t,
+            range_x,
+            out=p_dest_t,
+            where=scale_mask
+        )
+        np.power(
+            p_dest_t,
+            tfs.e_dest,
+            out=p_dest_t,
+            where=scale_mask
+        )
+        p_dest_t *= scale_mask
+
+        # normalize distributions over destinations that do not sum to zero
+        normalization_factor = np.sum(
+            p_dest_t,
+            axis=1,
+            keepdims=True
+        )
+        np.divide(
+            p_dest_t,
+            normalization_factor,
+            out=p_dest_t,
+            where=normalization_factor > 0
+        )
+        p_dest[:, :, time] = p_dest_t
+
+
+def create_sparse_distribution_p_dest(tfs):
+
+    """ Calculates the same probability distributions of choosing a 
+    destination as create_distribution_p_dest() from a sparse datatensor 
+    and stores them as sparse_tensors.SparseODTensor. Min-max values over 
+    time are found for each od pair with a travel time in any time step, 
+    and each time step is scaled and normalized per origin on its stored 
+    entries only. Memory and runtime grow with the number of observed od 
+    pairs instead of number_zones x number_zones.
+    """
+
+    datatensor_mean = tfs.datatensor_mean
+    if not isinstance(datatensor_mean, sparse_tensors.SparseODTensor):
+        datatensor_mean = sparse_tensors.create_sparse_tensor_from_dense(
+            datatensor_mean
         )
+
+    # row-major keys of the od pairs stored in each time step
+    key_list = [
+        datatensor_mean.row_ids(time) * tfs.number_zones
+        + datatensor_mean.indices[time]
+        for time in range(tfs.T)
+    ]
+    values = np.concatenate(datatensor_mean.data)
+    pair_keys, pair = np.unique(
+        np.concatenate(key_list),
+        return_inverse=True
     )
-    for source in range(tfs.number_zones):
 
-        for dest in range(tfs.number_zones):
-            value_array = tfs.datatensor_mean[source, dest, :]
-            max_x[source, dest] = np.amax(
-                value_array
-            )
-            min_x[source, dest] = np.amin(
-                value_array
+    # min-max values of each od pair over time. Pairs that are missing in 
+    # some time steps have a minimum of zero like in the dense datatensor
+    max_x = np.zeros(len(pair_keys))
+    min_x = np.full(len(pair_keys), np.inf)
+    np.maximum.at(max_x, pair, values)
+    np.minimum.at(min_x, pair, values)
+    min_x[np.bincount(pair, minlength=len(pair_keys)) < tfs.T] = 0
+    range_x = max_x - min_x
+
+    # only pairs with travel times that change over time are scaled. Pairs
+    # with constant travel times get zero weight
+    scale_mask = max_x > min_x
+
+    p_dest = sparse_tensors.SparseODTensor(
+        tfs.number_zones,
+        tfs.T
+    )
+    first = 0
+    for time in range(tfs.T):
+        last = first + len(key_list[time])
+        pair_t = pair[first:last]
+        first = last
+
+        # min-max scale and raise to the power of e_dest
+        scale_t = scale_mask[pair_t]
+        p_dest_t = np.zeros(len(pair_t))
+        p_dest_t[scale_t] = (
+            (
+                datatensor_mean.data[time][scale_t]
+                - min_x[pair_t[scale_t]]
             )
+            / range_x[pair_t[scale_t]]
+        )**tfs.e_dest
+
+        # normalize distributions over destinations that do not sum to zero
+        source = datatensor_mean.row_ids(time)
+        normalization_factor = np.bincount(
+            source,
+            weights=p_dest_t,
+            minlength=tfs.number_zones
+        )[source]
+        np.divide(
+            p_dest_t,
+            normalization_factor,
+            out=p_dest_t,
+            where=normalization_factor > 0
+        )
 
-    for source in range(tfs.number_zones):
+        # entries with zero probability are not stored
+        p_dest.set_time_slice(
+            time,
+            source,
+            datatensor_mean.indices[time],
+            p_dest_t
+        )
 
-        for dest in range(tfs.number_zones):
-
-            for time in range(tfs.T):
-                if max_x[source, dest] > 0:
-                    mean = tfs.datatensor_mean[source, dest, time]
-                    p_dest[source, dest, time] = (
-                        (
-                            (mean - min_x[source, dest]) / (
-                                max_x[source, dest] - min_x[source, dest]
-                            )
-                        )**tfs.e_dest
-                    )
+    tfs.p_dest = p_dest
 
-    for source in range(tfs.number_zones):
 
-        for time in range(tfs.T):
-            value_array = p_dest[source, :, time]
-            normalization_factor[source, time] = np.sum(
-                value_array
-            )
+def create_alias_tables_p_dest(tfs):
 
-    for source in range(tfs.number_zones):
+    """ Creates Walker alias tables of p_dest for sampling a destination in 
+    constant time. For each origin and time step, a destination column is 
+    drawn uniformly and kept with probability p_dest_alias_prob, or replaced 
+    by its alias p_dest_alias otherwise. Tables are built for all origins of
+    a time step at once by the sweeping method: each light column (scaled 
+    probability below 1) is filled by the heavy column whose cumulative 
+    excess covers the start of its cumulative deficit, and each heavy column
+    that is exhausted is filled by the next heavy column. p_dest_valid marks
+    origin-time combinations whose distribution does not sum to zero.
+    """
 
-        for time in range(tfs.T):
-            if normalization_factor[source, time] > 0:
-            
-                for dest in range(tfs.number_zones):
-                    p_dest[source, dest, time] = (
-                        p_dest[source, dest, time] / (
-                            normalization_factor[source, time]
-                        )
-                    )
+    # store alias indices in the smallest integer type that fits all zones
+    alias_dtype = compact_tensors.zone_index_dtype(tfs.number_zones)
 
-    tfs.p_dest = p_dest
+    # every entry is assigned below, one time slice at a time
+    p_dest_alias_prob = memmap_tensors.create_tensor(
+        tfs,
+        'p_dest_alias_prob',
+        np.float32
+    )
+    p_dest_alias = memmap_tensors.create_tensor(
+        tfs,
+        'p_dest_alias',
+        alias_dtype
+    )
+    p_dest_valid = np.zeros(
+        (
+            tfs.number_zones,
+            tfs.T
+        ),
+        dtype=bool
+    )
+
+    # positions and offsets that let us search all rows with one call
+    position = np.arange(tfs.number_zones)
+    row_start = position[:, np.newaxis] * tfs.number_zones
+    row_offset = position[:, np.newaxis] * (tfs.number_zones + 2.0)
+    scaled_p = np.ones(
+        (
+            tfs.number_zones,
+            tfs.number_zones
+        )
+    )
+
+    for time in range(tfs.T):
+        p_dest_t = tfs.p_dest[:, :, time]
+        row_sum = np.sum(p_dest_t, axis=1, keepdims=True)
+        valid_origin = row_sum > 0
+        p_dest_valid[:, time] = valid_origin[:, 0]
+
+        # scale probabilities to a mean of 1 per row. Rows that sum to zero
+        # get trivial tables
+        scaled_p.fill(1)
+        np.divide(
+            p_dest_t * tfs.number_zones,
+            row_sum,
+            out=scaled_p,
+            where=valid_origin
+        )
+
+        # sort light columns before heavy ones, keeping their order
+        heavy = scaled_p >= 1
+        order = np.argsort(heavy, axis=1, kind='stable')
+        sorted_p = np.take_along_axis(scaled_p, order, axis=1)
+        sorted_heavy = np.take_along_axis(heavy, order, axis=1)
+
+        # cumulative deficit of light and excess of heavy columns
+        deficit = np.where(sorted_heavy, 0, 1 - sorted_p)
+        excess = np.where(sorted_heavy, sorted_p - 1, 0)
+        cum_deficit = np.cumsum(deficit, axis=1)
+        cum_excess = np.cumsum(excess, axis=1)
+
+        # light columns are filled by the first heavy column whose
+        # cumulative excess exceeds the start of their deficit
+        light_alias = np.searchsorted(
+            (cum_excess + row_offset).ravel(),
+            (cum_deficit - deficit + row_offset).ravel(),
+            side='right'
+        ).reshape(scaled_p.shape) - row_start
+
+        # heavy columns keep what remains after the light column that 
+        # straddles their cumulative excess is filled
+        straddle = np.searchsorted(
+            (cum_deficit + row_offset).ravel(),
+            (cum_excess + row_offset).ravel(),
+            side='left'
+        ).reshape(scaled_p.shape) - row_start
+        overshoot = np.where(
+            straddle < tfs.number_zones,
+            np.take_along_axis(
+                cum_deficit,
+                np.minimum(straddle, tfs.number_zones - 1),
+                axis=1
+            ) - cum_excess,
+            0
+        )
+
+        sorted_prob = np.where(
+            sorted_heavy,
+            1 - np.clip(overshoot, 0, 1),
+            sorted_p
+        )
+        sorted_alias = np.minimum(
+            np.where(
+                sorted_heavy,
+                position + 1,
+                light_alias
+            ),
+            tfs.number_zones - 1
+        )
+
+        # map sorted positions back to destination columns
+        np.put_along_axis(
+            p_dest_alias_prob[:, :, time],
+            order,
+            sorted_prob,
+            axis=1
+        )
+        np.put_along_axis(
+            p_dest_alias[:, :, time],
+            order,
+            np.take_along_axis(order, sorted_alias, axis=1),
+            axis=1
+        )
+
+    tfs.p_dest_alias_prob = p_dest_alias_prob
+    tfs.p_dest_alias = p_dest_alias
+    tfs.p_dest_valid = p_dest_valid
 
 
 def create_distribution_p_joint(tfs):
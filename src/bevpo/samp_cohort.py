@@ -0,0 +1,339 @@
+import bevpo.calc_tfsprop as calc_tfsprop
+import bevpo.sparse_tensors as sparse_tensors
+
+import numpy as np
+
+
+def sample_traffic_cohorts(tfs):
+
+    """ Samples traffic by tracking the number of cars in each city zone
+    instead of every single car. Driving cars are drawn binomially and split
+    over destinations multinomially for each origin zone and time step, so
+    that runtime does not depend on the size of the vehicle fleet. Results
+    are zone level counts of driving and parking cars and aggregates of the
+    sampled trips.
+    """
+
+    # solve initial value problem for number of cars in each zone
+    zone_counts = solve_initial_value_problem_cohorts(tfs)
+
+    # simulate over all time steps
+    simulate_cohorts(
+        tfs,
+        zone_counts,
+        cohort_transition_sampling
+    )
+
+
+def expect_traffic_cohorts(tfs):
+
+    """ Calculates the expected traffic without sampling. p_drive and p_dest
+    define a time-inhomogeneous Markov chain over city zones, so that the 
+    expected number of cars in each zone is propagated exactly through one
+    matrix-vector product per time step. Results are the same zone level 
+    counts and trip aggregates as from sample_traffic_cohorts(), but without
+    Monte Carlo noise.
+    """
+
+    # start from the expected stationary number of cars in each zone
+    zone_counts = solve_initial_value_problem_cohorts(
+        tfs,
+        expected=True
+    )
+
+    # propagate over all time steps
+    simulate_cohorts(
+        tfs,
+        zone_counts,
+        cohort_transition_expectation
+    )
+
+
+def simulate_cohorts(
+    tfs,
+    zone_counts,
+    cohort_transition
+):
+
+    """ Simulates all time steps starting from the number of cars in each
+    zone zone_counts. cohort_transition returns the number of driving cars
+    per origin zone and the matrix of trips between all zones for a time 
+    step, either sampled or expected.
+    """
+
+    # bins of travel durations and distances are fixed before sampling
+    (
+        duration_bin_edges,
+        distance_bin_edges
+    ) = calc_tfsprop.create_travel_bin_edges(tfs)
+    number_bins = len(duration_bin_edges) - 1
+
+    driving_counts = np.zeros(
+        (
+            tfs.number_zones,
+            tfs.T
+        )
+    )
+    parking_counts = np.zeros(
+        (
+            tfs.number_zones,
+            tfs.T
+        )
+    )
+    travel_time_sums = np.zeros(tfs.T)
+    travel_distance_sums = np.zeros(tfs.T)
+    duration_counts_per_t = np.zeros(
+        (
+            tfs.T,
+            number_bins
+        )
+    )
+    distance_counts_per_t = np.zeros(
+        (
+            tfs.T,
+            number_bins
+        )
+    )
+
+    # simluate over all time steps
+    for t in range(tfs.T):
+        drivers, trips = cohort_transition(
+            tfs,
+            zone_counts,
+            t
+        )
+        driving_counts[:, t] = drivers
+        parking_counts[:, t] = zone_counts - drivers
+
+        # travel durations and distances of all origin destination pairs
+        travel_time, travel_distance = cohort_trip_properties(
+            tfs,
+            t
+        )
+        travel_time_sums[t] = np.sum(trips * travel_time)
+        travel_distance_sums[t] = np.sum(trips * travel_distance)
+
+        # count trips per bin and, if chosen, parked cars as zero values
+        # like the transition tensor of the per-car simulation does
+        if tfs.include_parked_in_distr:
+            parked = np.sum(zone_counts - drivers)
+        else:
+            parked = 0
+        duration_counts_per_t[t, :] = calc_tfsprop.count_travel_bins(
+            travel_time.ravel(),
+            duration_bin_edges,
+            weights=trips.ravel()
+        )
+        duration_counts_per_t[t, 0] += parked
+        distance_counts_per_t[t, :] = calc_tfsprop.count_travel_bins(
+            travel_distance.ravel(),
+            distance_bin_edges,
+            weights=trips.ravel()
+        )
+        distance_counts_per_t[t, 0] += parked
+
+        # update zone counts to parked cars plus arriving cars
+        zone_counts = zone_counts - drivers + np.sum(trips, axis=0)
+
+    # save results to class object attributes
+    tfs.driving_counts = driving_counts
+    tfs.parking_counts = parking_counts
+    tfs.travel_time_sums = travel_time_sums
+    tfs.travel_distance_sums = travel_distance_sums
+    tfs.duration_counts_per_t = duration_counts_per_t
+    tfs.distance_counts_per_t = distance_counts_per_t
+    tfs.duration_bin_edges = duration_bin_edges
+    tfs.distance_bin_edges = distance_bin_edges
+
+    # set distributions to zero for saving memory
+    tfs.p_drive = 0
+    tfs.p_dest = 0
+    tfs.p_joint = 0
+
+
+def solve_initial_value_problem_cohorts(
+    tfs,
+    expected=False
+):
+
+    """ Initializes the number of cars in each city zone from the periodic
+    stationary distribution of cars over city zones. If expected is True, 
+    the expected number of cars is returned, otherwise the number of cars is
+    sampled from this distribution.
+    """
+
+    zone_distribution = solve_stationary_zone_distribution(tfs)
+
+    if expected:
+        zone_counts = tfs.C * zone_distribution
+    else:
+        zone_counts = tfs.rng.multinomial(
+            tfs.C,
+            zone_distribution
+        )
+
+    return zone_counts
+
+
+def solve_stationary_zone_distribution(
+    tfs,
+    tolerance=1e-10,
+    max_iterations=1000
+):
+
+    """ Calculates the periodic stationary distribution of cars over city 
+    zones at the first time step by power iteration on the transition 
+    operator of an entire day, i.e. the composition of the transitions of all
+    T time steps. Iterates until the distribution changes by less than 
+    tolerance in L1 norm or max_iterations days are propagated.
+    """
+
+    # origin-time combinations whose destination distribution does not sum 
+    # to zero. Cars in other origins stay in the same zone
+    valid_origin = np.sum(tfs.p_dest, axis=1) > 0
+
+    # start from uniformly distributed cars
+    zone_distribution = np.full(
+        tfs.number_zones,
+        1 / tfs.number_zones
+    )
+    for iteration in range(max_iterations):
+        next_zone_distribution = zone_distribution
+        
+        # propagate over all time steps of a day
+        for t in range(tfs.T):
+            next_zone_distribution = propagate_zone_distribution(
+                tfs,
+                next_zone_distribution,
+                valid_origin[:, t],
+                t
+            )
+        next_zone_distribution /= np.sum(next_zone_distribution)
+        
+        change = np.sum(
+            np.abs(next_zone_distribution - zone_distribution)
+        )
+        zone_distribution = next_zone_distribution
+        if change < tolerance:
+            break
+
+    return zone_distribution
+
+
+def propagate_zone_distribution(
+    tfs,
+    zone_distribution,
+    valid_origin,
+    t
+):
+
+    """ Propagates a distribution of cars over city zones by one time step
+    through a single matrix-vector product with p_dest, without building the
+    matrix of trips. Sparse p_dest is multiplied on its stored entries only.
+    """
+
+    moving = zone_distribution * tfs.p_drive[:, t] * valid_origin
+
+    if isinstance(tfs.p_dest, sparse_tensors.SparseODTensor):
+        arriving = tfs.p_dest.left_multiply(
+            moving,
+            t
+        )
+    else:
+        arriving = moving @ tfs.p_dest[:, :, t]
+    
+    return zone_distribution - moving + arriving
+
+
+def cohort_transition_sampling(
+    tfs,
+    zone_counts,
+    t
+):
+
+    """ Samples the number of driving cars in each zone from p_drive and
+    splits them over destinations from p_dest. Returns the number of driving
+    cars per origin zone and a number_zones x number_zones matrix of trips.
+    """
+
+    # sample number of driving cars per origin zone
+    drivers = tfs.rng.binomial(
+        zone_counts,
+        tfs.p_drive[:, t]
+    )
+
+    # split driving cars over destinations
+    trips = tfs.rng.multinomial(
+        drivers,
+        create_cohort_distribution(
+            tfs,
+            t
+        )
+    )
+
+    return drivers, trips
+
+
+def cohort_transition_expectation(
+    tfs,
+    zone_counts,
+    t
+):
+
+    """ Calculates the expected number of driving cars in each zone from 
+    p_drive and their expected split over destinations from p_dest. Returns
+    the expected number of driving cars per origin zone and a number_zones x
+    number_zones matrix of expected trips.
+    """
+
+    drivers = zone_counts * tfs.p_drive[:, t]
+    trips = drivers[:, np.newaxis] * create_cohort_distribution(
+        tfs,
+        t
+    )
+
+    return drivers, trips
+
+
+def create_cohort_distribution(
+    tfs,
+    t
+):
+
+    """ Returns the number_zones x number_zones matrix of destination
+    probabilities of all origin zones in time step t, normalized to sum to 1
+    per origin. Cars in origin zones whose p_dest sums to zero drive within 
+    the same zone.
+    """
+
+    # destination distributions of all origins. If distribution sum is zero,
+    # cars have destination in same zone
+    distribution = tfs.p_dest[:, :, t].copy()
+    row_sum = np.sum(distribution, axis=1)
+    stay_origin = np.nonzero(row_sum == 0)[0]
+    distribution[stay_origin, stay_origin] = 1
+    row_sum[stay_origin] = 1
+    distribution /= row_sum[:, np.newaxis]
+
+    return distribution
+
+
+def cohort_trip_properties(
+    tfs,
+    t
+):
+
+    """ Returns the travel durations and distances of trips between all
+    origin destination pairs in time step t. These are the mean travel times
+    and od distances, and five minutes and 1 km for trips within the same
+    city zone.
+    """
+
+    travel_time = tfs.datatensor_mean[:, :, t].copy()
+    travel_distance = tfs.od_distances_array.astype(float)
+
+    # assumption: five minutes of travel time and 1 km of travel distance
+    np.fill_diagonal(travel_time, 5 * 60)
+    np.fill_diagonal(travel_distance, 1)
+
+    return travel_time, travel_distance
@@ -0,0 +1,203 @@
+import bevpo.samp_traf as samp_traf
+import bevpo.shared_tables as shared_tables
+
+import concurrent.futures
+import numpy as np
+
+
+# per-car tensors that sampling processes fill for disjoint shards of cars
+SHARED_CAR_TENSOR_NAMES = (
+    'state_tensor',
+    'transition_tensor'
+)
+
+# traffic system and attached shared memory blocks of each worker process
+worker_traffic_system = None
+worker_shared_memory_list = []
+
+
+def sample_traffic_processes(tfs):
+
+    """ Samples traffic for all time steps in a pool of tfs.sampling_processes
+    worker processes. The initial state of all cars is solved first. Then, 
+    probability tables, datatensors and per-car tensors are published in 
+    shared memory, so that workers attach to them without copying and each 
+    samples a disjoint shard of cars with its own random number generators
+    spawned from tfs.rng. Shared memory is released when sampling finishes
+    or fails.
+    """
+
+    if tfs.compact_layout:
+        raise ValueError(
+            'sampling_processes requires compact_layout=False'
+        )
+
+    # solve initial value problem for traffic state
+    samp_traf.solve_initial_value_problem(
+        tfs,
+        samp_traf.create_stage_rngs(tfs.rng)['initial_state']
+    )
+
+    # split cars into shards with independent streams for each sampling
+    # stage
+    shard_bounds = create_car_shards(
+        tfs.C,
+        tfs.number_shards or tfs.sampling_processes
+    )
+    stage_rngs_list = [
+        samp_traf.create_stage_rngs(rng)
+        for rng in tfs.rng.spawn(len(shard_bounds))
+    ]
+
+    with shared_tables.publish_shared_tables(
+        tfs,
+        shared_tables.SHARED_TABLE_NAMES + SHARED_CAR_TENSOR_NAMES
+    ) as (table_specs, shared_arrays):
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=tfs.sampling_processes,
+            initializer=init_sampling_worker,
+            initargs=(
+                shared_tables.create_unshared_copy(
+                    tfs,
+                    table_specs
+                ),
+                table_specs
+            )
+        ) as executor:
+            future_list = [
+                executor.submit(
+                    sample_car_shard_in_worker,
+                    first_car,
+                    last_car,
+                    stage_rngs
+                )
+                for (first_car, last_car), stage_rngs in zip(
+                    shard_bounds,
+                    stage_rngs_list
+                )
+            ]
+            # raise errors of workers
+            for future in future_list:
+                future.result()
+
+        # copy sampled per-car tensors back from shared memory
+        for name in SHARED_CAR_TENSOR_NAMES:
+            getattr(tfs, name)[...] = shared_arrays[name]
+
+
+def sample_traffic_threads(tfs):
+
+    """ Samples traffic for all time steps in a pool of tfs.sampling_threads
+    threads. The initial state of all cars is solved first. Then, cars are 
+    split into contiguous shards, each with its own random number generators
+    spawned from tfs.rng, and driving, destination and travel sampling of 
+    each time step runs across shards in parallel. Threads share all arrays
+    without copying, and results are the same for a fixed seed and number of
+    shards as with sample_traffic_processes().
+    """
+
+    # solve initial value problem for traffic state
+    samp_traf.solve_initial_value_problem(
+        tfs,
+        samp_traf.create_stage_rngs(tfs.rng)['initial_state']
+    )
+
+    # split cars into shards with independent streams for each sampling
+    # stage
+    shard_bounds = create_car_shards(
+        tfs.C,
+        tfs.number_shards or tfs.sampling_threads
+    )
+    stage_rngs_list = [
+        samp_traf.create_stage_rngs(rng)
+        for rng in tfs.rng.spawn(len(shard_bounds))
+    ]
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=tfs.sampling_threads
+    ) as executor:
+        for t in range(tfs.T):
+            # cumulative distributions are calculated once for all shards
+            if tfs.destination_sampling == 'alias':
+                cumulative_p_dest = None
+            else:
+                cumulative_p_dest = samp_traf.create_cumulative_p_dest(
+                    tfs,
+                    t
+                )
+
+            future_list = [
+                executor.submit(
+                    samp_traf.sample_car_shard_step,
+                    tfs,
+                    first_car,
+                    last_car,
+                    t,
+                    stage_rngs,
+                    cumulative_p_dest
+                )
+                for (first_car, last_car), stage_rngs in zip(
+                    shard_bounds,
+                    stage_rngs_list
+                )
+            ]
+            # wait for all shards of time step and raise errors of threads
+            for future in future_list:
+                future.result()
+
+
+def create_car_shards(
+    C,
+    number_shards
+):
+
+    """ Returns a list of (first_car, last_car) bounds that split C cars into 
+    number_shards contiguous shards of nearly equal size.
+    """
+
+    shard_edges = np.linspace(
+        0,
+        C,
+        min(number_shards, C) + 1
+    ).astype(int)
+
+    return list(
+        zip(
+            shard_edges[:-1],
+            shard_edges[1:]
+        )
+    )
+
+
+def init_sampling_worker(
+    worker_tfs,
+    table_specs
+):
+
+    """ Attaches the traffic system of a worker process to the shared memory
+    blocks of table_specs on start-up. """
+
+    global worker_traffic_system, worker_shared_memory_list
+    worker_shared_memory_list = shared_tables.attach_shared_tables(
+        worker_tfs,
+        table_specs
+    )
+    worker_traffic_system = worker_tfs
+
+
+def sample_car_shard_in_worker(
+    first_car,
+    last_car,
+    stage_rngs
+):
+
+    """ Samples one shard of cars in a worker process. Results are written
+    to the shared per-car tensors. """
+
+    samp_traf.sample_car_shard(
+        worker_traffic_system,
+        first_car,
+        last_car,
+        stage_rngs
+    )
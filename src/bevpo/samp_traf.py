@@ -1,191 +1,653 @@
+import bevpo.samp_cohort as samp_cohort
+import bevpo.calc_tfsprop as calc_tfsprop
+import bevpo.samp_parallel as samp_parallel
+import bevpo.sparse_tensors as sparse_tensors
+
 import numpy as np
-import random
+
+
+# sampling stages that draw from independent random number streams
+SAMPLING_STAGES = (
+    'initial_state',
+    'driving',
+    'destination',
+    'travel'
+)
 
 
 def sample_traffic(tfs):
 
     """ Initializes the traffic system state and then samples traffic for
-    all time steps.
+    all time steps. If tfs.streaming is True, only the current state of each
+    car is kept and results are accumulated on the fly.
     """
 
-    # solve initial value problem for traffic state
-    solve_initial_value_problem(tfs)
+    if tfs.streaming:
+        sample_traffic_streaming(tfs)
 
-    # simluate over all time steps
-    for t in range(tfs.T):
-        driving_activity_sampling(
-            tfs,
-            t
-        )
-        destination_choice_sampling(
-            tfs,
-            t
-        )
-        traveltime_and_distance_sampling(
+    elif tfs.sampling_processes is not None:
+        samp_parallel.sample_traffic_processes(tfs)
+
+    elif tfs.sampling_threads is not None:
+        samp_parallel.sample_traffic_threads(tfs)
+
+    else:
+        # independent random number streams of all sampling stages
+        stage_rngs = create_stage_rngs(tfs.rng)
+
+        # solve initial value problem for traffic state
+        solve_initial_value_problem(
             tfs,
-            t
+            stage_rngs['initial_state']
         )
-        # update state matrix only up to last time step,
-        # but sample transition matrix one step beyond last.
-        if t < tfs.T-1:
-            tfs.state_tensor[:, t+1] = tfs.transition_tensor[:, t, 1]
+
+        # simluate over all time steps
+        for t in range(tfs.T):
+            driving_activity_sampling(
+                tfs,
+                t,
+                stage_rngs['driving']
+            )
+            destination_choice_sampling(
+                tfs,
+                t,
+                stage_rngs['destination']
+            )
+            traveltime_and_distance_sampling(
+                tfs,
+                t,
+                stage_rngs['travel']
+            )
+            # update state matrix only up to last time step,
+            # but sample transition matrix one step beyond last.
+            if t < tfs.T-1:
+                tfs.state_tensor[:, t+1] = tfs.transition_tensor[:, t, 1]
 
     # set distributions to zero for saving memory
     tfs.p_drive = 0
     tfs.p_dest = 0
     tfs.p_joint = 0
+    tfs.p_dest_alias_prob = 0
+    tfs.p_dest_alias = 0
+
+
+def create_stage_rngs(rng):
 
-def solve_initial_value_problem(tfs):
-
-    """ Initializes the traffic system state by first distributing all cars
-    uniformly accross all city zones and then sampling through all time steps.
-    The resulting system state after an entire sampling process is then taken
-    as the initial system state. """
-
-    # uniformly assign cars to to all city zones for state in initial time step
-    zone = 0
-    for car in range(0, tfs.C, tfs.cars_per_zone):
-        tfs.state_tensor[car:(car+tfs.cars_per_zone), 0] = zone
-        zone += 1
-        
-    # transform to integer values
-    tfs.state_tensor = tfs.state_tensor.astype(int)
-    
-    # sample over all time steps
+    """ Returns a dictionary of random number generators for all 
+    SAMPLING_STAGES, spawned as independent child streams of rng. Changing 
+    the number of draws in one stage hence does not change the outcomes of
+    the other stages.
+    """
+
+    return dict(
+        zip(
+            SAMPLING_STAGES,
+            rng.spawn(len(SAMPLING_STAGES))
+        )
+    )
+
+
+def sample_traffic_streaming(tfs):
+
+    """ Samples traffic for all time steps while keeping only the current
+    location of each car. Counts of driving and parking cars per city zone,
+    sums of travel times and distances and their histograms are accumulated
+    for each time step, so that neither state_tensor nor transition_tensor
+    are needed. If tfs.include_parked_in_distr is True, parked cars are 
+    counted with zero travel time and distance like in transition_tensor.
+    """
+
+    # bins of travel durations and distances are fixed before sampling
+    (
+        duration_bin_edges,
+        distance_bin_edges
+    ) = calc_tfsprop.create_travel_bin_edges(tfs)
+    number_bins = len(duration_bin_edges) - 1
+
+    driving_counts = np.zeros(
+        (
+            tfs.number_zones,
+            tfs.T
+        )
+    )
+    parking_counts = np.zeros(
+        (
+            tfs.number_zones,
+            tfs.T
+        )
+    )
+    travel_time_sums = np.zeros(tfs.T)
+    travel_distance_sums = np.zeros(tfs.T)
+    duration_counts_per_t = np.zeros(
+        (
+            tfs.T,
+            number_bins
+        )
+    )
+    distance_counts_per_t = np.zeros(
+        (
+            tfs.T,
+            number_bins
+        )
+    )
+
+    # independent random number streams of all sampling stages
+    stage_rngs = create_stage_rngs(tfs.rng)
+
+    # solve initial value problem for location of each car
+    state = sample_initial_state(
+        tfs,
+        stage_rngs['initial_state']
+    )
+
+    # simluate over all time steps
     for t in range(tfs.T):
-        driving_activity_sampling(
+        drive = sample_driving_activity(
             tfs,
-            t
+            state,
+            t,
+            stage_rngs['driving']
         )
-        destination_choice_sampling(
+        origin = state[drive]
+        destination = sample_destinations(
             tfs,
-            t
+            origin,
+            t,
+            stage_rngs['destination']
+        )
+        travel_time, travel_distance = sample_travel_times_and_distances(
+            tfs,
+            origin,
+            destination,
+            t,
+            stage_rngs['travel']
         )
 
-        if t < tfs.T-1:
-            tfs.state_tensor[:, t+1] = tfs.transition_tensor[:, t, 1]
+        # accumulate results of current time step
+        driving_counts[:, t] = np.bincount(
+            origin,
+            minlength=tfs.number_zones
+        )
+        parking_counts[:, t] = np.bincount(
+            state[~drive],
+            minlength=tfs.number_zones
+        )
+        travel_time_sums[t] = np.sum(travel_time)
+        travel_distance_sums[t] = np.sum(travel_distance)
+        if tfs.include_parked_in_distr:
+            parked = tfs.C - len(origin)
         else:
-            tfs.state_tensor[:, 0] = tfs.transition_tensor[:, -1, 1].astype(int)
+            parked = 0
+        duration_counts_per_t[t, :] = calc_tfsprop.count_travel_bins(
+            travel_time,
+            duration_bin_edges
+        )
+        duration_counts_per_t[t, 0] += parked
+        distance_counts_per_t[t, :] = calc_tfsprop.count_travel_bins(
+            travel_distance,
+            distance_bin_edges
+        )
+        distance_counts_per_t[t, 0] += parked
+
+        # move driving cars to their destinations
+        state[drive] = destination
+
+    # save results to class object attributes
+    tfs.driving_counts = driving_counts
+    tfs.parking_counts = parking_counts
+    tfs.travel_time_sums = travel_time_sums
+    tfs.travel_distance_sums = travel_distance_sums
+    tfs.duration_counts_per_t = duration_counts_per_t
+    tfs.distance_counts_per_t = distance_counts_per_t
+    tfs.duration_bin_edges = duration_bin_edges
+    tfs.distance_bin_edges = distance_bin_edges
+
+
+def solve_initial_value_problem(
+    tfs,
+    rng=None
+):
+
+    """ Initializes the traffic system state by assigning all cars to city
+    zones from the periodic stationary distribution of cars over city zones.
+    The distribution is found by power iteration on the transition operator
+    of an entire day, so that no sampling pass is needed for burn-in. Draws
+    from rng, or from tfs.rng if no generator is passed. """
+
+    if rng is None:
+        rng = tfs.rng
+
+    tfs.state_tensor[:, 0] = sample_initial_state(
+        tfs,
+        rng
+    )
+
+
+def sample_initial_state(
+    tfs,
+    rng
+):
+
+    """ Returns the initial city zone of each car, drawn at once from the
+    periodic stationary distribution of cars over city zones.
+    """
+
+    # stationary distribution of cars over city zones in initial time step
+    zone_distribution = samp_cohort.solve_stationary_zone_distribution(tfs)
+
+    # assign cars to city zones in one draw
+    zone_counts = rng.multinomial(
+        tfs.C,
+        zone_distribution
+    )
+
+    return np.repeat(
+        np.arange(tfs.number_zones),
+        zone_counts
+    )
+
+
+def sample_car_shard(
+    tfs,
+    first_car,
+    last_car,
+    stage_rngs
+):
+
+    """ Samples traffic for all time steps of the cars first_car up to 
+    last_car, whose initial state is already assigned, with the random 
+    number generators stage_rngs of the shard. Cars move independently of
+    each other, so that disjoint shards of cars can be sampled in parallel.
+    """
+
+    for t in range(tfs.T):
+        sample_car_shard_step(
+            tfs,
+            first_car,
+            last_car,
+            t,
+            stage_rngs
+        )
+
+
+def sample_car_shard_step(
+    tfs,
+    first_car,
+    last_car,
+    t,
+    stage_rngs,
+    cumulative_p_dest=None
+):
+
+    """ Samples driving activity, destinations and travel times and distances
+    of the cars first_car up to last_car in time step t with the random 
+    number generators stage_rngs of the shard. cumulative_p_dest may pass
+    the result of create_cumulative_p_dest() for t, so that it is shared by
+    all shards.
+    """
+
+    shard = slice(first_car, last_car)
+    origin = tfs.state_tensor[shard, t]
+    drive = sample_driving_activity(
+        tfs,
+        origin,
+        t,
+        stage_rngs['driving']
+    )
+
+    # parked cars stay in their origin with zero travel time and distance
+    destination = origin.copy()
+    travel_time = np.zeros(len(origin))
+    travel_distance = np.zeros(len(origin))
+    destination[drive] = sample_destinations(
+        tfs,
+        origin[drive],
+        t,
+        stage_rngs['destination'],
+        cumulative_p_dest
+    )
+    (
+        travel_time[drive],
+        travel_distance[drive]
+    ) = sample_travel_times_and_distances(
+        tfs,
+        origin[drive],
+        destination[drive],
+        t,
+        stage_rngs['travel']
+    )
+
+    # save the sampling outcomes in transition matrix entries of
+    # car-timestep combinations
+    tfs.transition_tensor[shard, t, 0] = drive
+    tfs.transition_tensor[shard, t, 1] = destination
+    tfs.transition_tensor[shard, t, 2] = travel_time
+    tfs.transition_tensor[shard, t, 3] = travel_distance
+
+    # update state matrix only up to last time step
+    if t < tfs.T-1:
+        tfs.state_tensor[shard, t+1] = destination
 
 
 def driving_activity_sampling(
     tfs,
-    t
+    t,
+    rng=None
 ):
 
     """ Samples if a car drives or stays parked in a respective city zone
-    from p_drive.
+    from p_drive. Draws from rng, or from tfs.rng if no generator is passed.
      """
 
-    # iterate over all cars we simulate
-    for car in range(tfs.C):
-        # set origin zone to location of car in t
-        origin = tfs.state_tensor[car, t]
-        # get driving probability for origin-time combination
-        driving_probability = tfs.p_drive[origin, t]
-        # sample if car drives from this probability
-        drive = np.random.choice(
-            [1, 0],
-            p=[driving_probability, 1-driving_probability]
-        )
-        # assig sampling outcome to transition matrix of car-timestep combination
-        tfs.transition_tensor[car, t, 0] = drive
-        # if car stays parked, also assign destination zone to stay orgin
-        # in the transition matrix of car-timestep combination
-        if drive == 0:
-            tfs.transition_tensor[car, t, 1] = origin
+    if rng is None:
+        rng = tfs.rng
 
+    # set origin zones to location of cars in t
+    origin = tfs.state_tensor[:, t]
+    # sample if cars drive
+    drive = sample_driving_activity(
+        tfs,
+        origin,
+        t,
+        rng
+    )
+    # assign sampling outcomes to transition matrix of car-timestep combinations
+    tfs.transition_tensor[:, t, 0] = drive
+    # if cars stay parked, also assign destination zone to stay orgin
+    # in the transition matrix of car-timestep combinations
+    parked = ~drive
+    tfs.transition_tensor[parked, t, 1] = origin[parked]
 
-def destination_choice_sampling(
+
+def sample_driving_activity(
+    tfs,
+    origin,
+    t,
+    rng
+):
+
+    """ Returns a boolean array of which cars in origin zones drive in time
+    step t. Outcomes of all cars are drawn at once by comparing one uniform
+    random number per car against the driving probability of its origin-time
+    combination.
+    """
+
+    # get driving probabilities for origin-time combinations
+    driving_probability = tfs.p_drive[origin, t]
+
+    # sample if cars drive from these probabilities
+    return rng.random(len(origin)) < driving_probability
+
+
+def create_cumulative_p_dest(
     tfs,
     t
 ):
 
-    """ Samples travel destinations from p_dest. """
-
-    # iterate over all cars
-    for car in range(tfs.C):
-        
-        # get binary sampling result from driving_activity_sampling() 
-        drive = tfs.transition_tensor[car, t, 0]
-        
-        # only if car is sampled to drive, make a change to transition matrix
-        # otherwise, we have already assigned destination to stay origin of 
-        # car in in tfs.transition_tensor during driving_activity_sampling().
-        if drive == 1:
-            # get location of car
-            origin = tfs.state_tensor[car, t]
-            # get probability distribution of location-timestep combination
-            distribution = tfs.p_dest[origin, :, t]
-            # if distribution sum is zero, car has destination in same zone
-            if sum(distribution) == 0:
-                destination = origin
-            else:
-                # otherwise, car chooses destination with probabilities 
-                # from corresponding distribution
-                destination = np.random.choice(
-                    range(tfs.number_zones),
-                    p=distribution
-                )
-                
-            # save the sampling outcome in transition matrix entry of
-            # car-timestep combination
-            tfs.transition_tensor[car, t, 1] = destination
+    """ Calculates the cumulative distributions of choosing a destination
+    from each origin zone in time step t. Each row is normalized to end in 1
+    and shifted by its origin position, so that the flattened array is sorted
+    and destinations of cars from all origins can be sampled with a single
+    searchsorted call. Also returns a boolean array of origins whose
+    distribution does not sum to zero. Sparse p_dest is accumulated on its
+    stored entries only.
+    """
+
+    if isinstance(tfs.p_dest, sparse_tensors.SparseODTensor):
+        return tfs.p_dest.create_cumulative_rows(t)
+
+    # cumulative distributions of all origins in t
+    cumulative_p_dest = np.cumsum(
+        tfs.p_dest[:, :, t],
+        axis=1
+    )
+    row_sum = cumulative_p_dest[:, -1].copy()
+    valid_origin = row_sum > 0
+
+    # normalize rows to end in exactly 1
+    np.divide(
+        cumulative_p_dest,
+        row_sum[:, np.newaxis],
+        out=cumulative_p_dest,
+        where=valid_origin[:, np.newaxis]
+    )
+    cumulative_p_dest[valid_origin, -1] = 1
+
+    # shift each row by its origin position
+    cumulative_p_dest += np.arange(tfs.number_zones)[:, np.newaxis]
+
+    return cumulative_p_dest.ravel(), valid_origin
+
+
+def destination_choice_sampling(
+    tfs,
+    t,
+    rng=None
+):
+
+    """ Samples travel destinations from p_dest, either by inverse transform
+    sampling or from alias tables depending on tfs.destination_sampling. 
+    Draws from rng, or from tfs.rng if no generator is passed.
+    """
+
+    if rng is None:
+        rng = tfs.rng
+
+    # get binary sampling result from driving_activity_sampling()
+    drive = tfs.transition_tensor[:, t, 0] == 1
+
+    # only cars that are sampled to drive change their entry in transition
+    # matrix. Otherwise, we have already assigned destination to stay origin
+    # of car in tfs.transition_tensor during driving_activity_sampling().
+    origin = tfs.state_tensor[drive, t]
+
+    # save the sampling outcome in transition matrix entries of
+    # car-timestep combinations
+    tfs.transition_tensor[drive, t, 1] = sample_destinations(
+        tfs,
+        origin,
+        t,
+        rng
+    )
+
+
+def sample_destinations(
+    tfs,
+    origin,
+    t,
+    rng,
+    cumulative_p_dest=None
+):
+
+    """ Returns destinations of cars driving from origin zones in time step
+    t, sampled with the method chosen by tfs.destination_sampling.
+    cumulative_p_dest may pass the result of create_cumulative_p_dest() for 
+    inverse transform sampling.
+    """
+
+    if tfs.destination_sampling == 'alias':
+        destination = alias_destination_sampling(
+            tfs,
+            origin,
+            t,
+            rng
+        )
+    else:
+        destination = inverse_cdf_destination_sampling(
+            tfs,
+            origin,
+            t,
+            rng,
+            cumulative_p_dest
+        )
+
+    return destination
+
+
+def inverse_cdf_destination_sampling(
+    tfs,
+    origin,
+    t,
+    rng,
+    cumulative_p_dest=None
+):
+
+    """ Samples destinations of cars in origin zones by inverse transform
+    sampling on cumulative distributions that are calculated once per time
+    step, unless they are passed as cumulative_p_dest. Takes 
+    O(log(number_zones)) time per car.
+    """
+
+    # get cumulative distributions of all origin-timestep combinations
+    if cumulative_p_dest is None:
+        cumulative_p_dest = create_cumulative_p_dest(
+            tfs,
+            t
+        )
+    cumulative_p_dest, valid_origin = cumulative_p_dest
+
+    # if distribution sum is zero, car has destination in same zone
+    destination = origin.copy()
+
+    # otherwise, cars choose destinations with probabilities from
+    # corresponding distributions
+    # zone positions of the compact layout are small integers, which would
+    # overflow when shifted by origin rows below
+    moving = valid_origin[origin]
+    moving_origin = origin[moving].astype(np.intp)
+    random_value = rng.random(len(moving_origin)) + moving_origin
+    # destinations of sparse p_dest are looked up from its stored entries
+    if isinstance(tfs.p_dest, sparse_tensors.SparseODTensor):
+        destination[moving] = tfs.p_dest.sample_columns(
+            t,
+            cumulative_p_dest,
+            moving_origin,
+            random_value
+        )
+    else:
+        destination[moving] = np.minimum(
+            np.searchsorted(
+                cumulative_p_dest,
+                random_value,
+                side='right'
+            ) - moving_origin * tfs.number_zones,
+            tfs.number_zones - 1
+        )
+
+    return destination
+
+
+def alias_destination_sampling(
+    tfs,
+    origin,
+    t,
+    rng
+):
+
+    """ Samples destinations of cars in origin zones from the alias tables
+    created by prob_dist.create_alias_tables_p_dest(). Takes constant time
+    per car.
+    """
+
+    # if distribution sum is zero, car has destination in same zone
+    destination = origin.copy()
+
+    # otherwise, draw a column uniformly and keep it or take its alias
+    moving = tfs.p_dest_valid[origin, t]
+    moving_origin = origin[moving]
+    column = rng.integers(
+        tfs.number_zones,
+        size=len(moving_origin)
+    )
+    keep_column = (
+        rng.random(len(moving_origin))
+        < tfs.p_dest_alias_prob[moving_origin, column, t]
+    )
+    destination[moving] = np.where(
+        keep_column,
+        column,
+        tfs.p_dest_alias[moving_origin, column, t]
+    )
+
+    return destination
 
 
 def traveltime_and_distance_sampling(
     tfs,
-    t
+    t,
+    rng=None
 ):
 
     """ Samples travel times and distances from normal Gaussian distributions.
+    Draws from rng, or from tfs.rng if no generator is passed.
     """
 
-    # iterate over all cars
-    for car in range(tfs.C):
-        # get if car is sampled to drive
-        drive = tfs.transition_tensor[car, t, 0]
-
-        # sample driving duration and distance only if car drives
-        if drive == 1:
-            # get origin-destination sampling results
-            origin = tfs.state_tensor[car, t]
-            destination = int(
-                round(
-                    tfs.transition_tensor[car, t, 1]
-                )
-            )
+    if rng is None:
+        rng = tfs.rng
+
+    # get cars that are sampled to drive
+    drive = tfs.transition_tensor[:, t, 0] == 1
+
+    # get origin-destination sampling results of driving cars
+    origin = tfs.state_tensor[drive, t]
+    destination = np.rint(
+        tfs.transition_tensor[drive, t, 1]
+    ).astype(int)
 
-            # if car drives within same city zone, use assumptions
-            if origin == destination:
-                # assumption: five minutes of travel time
-                tfs.transition_tensor[car, t, 2] = 5 * 60
-                # assumption: 1 km of travel distance
-                tfs.transition_tensor[car, t, 3] = 1
-            else:
-                # Sampling travel times
-                mean = tfs.datatensor_mean[origin, destination, t]
-                if type(tfs.datatensor_stddev) != int:
-                    std_deviation = tfs.datatensor_stddev[origin, destination, t]
-                else:
-                    std_deviation = 1 # CAUTION: assumption
-
-                tfs.transition_tensor[car, t, 2] = abs(
-                    np.random.normal(
-                        mean,
-                        std_deviation
-                    )
-                )
-                
-                # Sampling travel distances
-                mean = tfs.od_distances.iloc[origin, destination]
-                std_deviation = 0.1 # CAUTION: assumption
-                tfs.transition_tensor[car, t, 3] = abs(
-                    np.random.normal(
-                        mean,
-                        std_deviation
-                    )
-                )
-                
+    (
+        tfs.transition_tensor[drive, t, 2],
+        tfs.transition_tensor[drive, t, 3]
+    ) = sample_travel_times_and_distances(
+        tfs,
+        origin,
+        destination,
+        t,
+        rng
+    )
+
+
+def sample_travel_times_and_distances(
+    tfs,
+    origin,
+    destination,
+    t,
+    rng
+):
+
+    """ Returns travel times and distances of cars driving from origin to
+    destination zones in time step t. Means and standard deviations of all
+    cars are gathered at once and sampled with one batched draw for each
+    quantity.
+    """
+
+    # Sampling travel times
+    mean = tfs.datatensor_mean[origin, destination, t]
+    if type(tfs.datatensor_stddev) != int:
+        std_deviation = tfs.datatensor_stddev[origin, destination, t]
+    else:
+        std_deviation = 1 # CAUTION: assumption
+    travel_time = np.abs(
+        rng.normal(
+            mean,
+            std_deviation
+        )
+    )
+
+    # Sampling travel distances
+    mean = tfs.od_distances_array[origin, destination]
+    std_deviation = 0.1 # CAUTION: assumption
+    travel_distance = np.abs(
+        rng.normal(
+            mean,
+            std_deviation
+        )
+    )
 
+    # if car drives within same city zone, use assumptions
+    same_zone = origin == destination
+    # assumption: five minutes of travel time
+    travel_time[same_zone] = 5 * 60
+    # assumption: 1 km of travel distance
+    travel_distance[same_zone] = 1
 
+    return travel_time, travel_distance
@@ -0,0 +1,161 @@
+import contextlib
+import copy
+import multiprocessing.shared_memory as shared_memory
+import pandas as pd
+import numpy as np
+
+
+# probability tables and datatensors that are read by all sampling processes
+SHARED_TABLE_NAMES = (
+    'p_drive',
+    'p_dest',
+    'p_dest_alias_prob',
+    'p_dest_alias',
+    'p_dest_valid',
+    'datatensor_mean',
+    'datatensor_stddev',
+    'od_distances_array'
+)
+
+# labeled DataFrames that wrap a shared table and are rebuilt from it in 
+# worker processes instead of being pickled
+SHARED_TABLE_VIEWS = {
+    'od_distances': 'od_distances_array'
+}
+
+
+@contextlib.contextmanager
+def publish_shared_tables(
+    tfs,
+    table_names=SHARED_TABLE_NAMES
+):
+
+    """ Copies the arrays of tfs named in table_names into shared memory 
+    blocks, one per array. Yields a dictionary of table specifications that
+    worker processes pass to attach_shared_tables(), and a dictionary of 
+    arrays backed by the shared blocks. Attributes that are not arrays, like
+    zero placeholders, are skipped. All blocks are closed and unlinked when
+    the context is left, also if sampling fails.
+    """
+
+    shared_memory_list = []
+    table_specs = {}
+    shared_arrays = {}
+
+    try:
+        for name in table_names:
+            table = getattr(tfs, name, 0)
+            if not isinstance(table, np.ndarray):
+                continue
+
+            block = shared_memory.SharedMemory(
+                create=True,
+                size=max(table.nbytes, 1)
+            )
+            shared_memory_list.append(block)
+
+            # copy table into shared memory block
+            shared_array = np.ndarray(
+                table.shape,
+                dtype=table.dtype,
+                buffer=block.buf
+            )
+            shared_array[...] = table
+
+            table_specs[name] = (
+                block.name,
+                table.shape,
+                table.dtype.str
+            )
+            shared_arrays[name] = shared_array
+
+        yield table_specs, shared_arrays
+
+    finally:
+        # release array views before closing the blocks they point to
+        shared_arrays.clear()
+        release_shared_tables(
+            shared_memory_list,
+            unlink=True
+        )
+
+
+def attach_shared_tables(
+    tfs,
+    table_specs
+):
+
+    """ Attaches to the shared memory blocks of table_specs and sets the 
+    respective attributes of tfs to arrays backed by these blocks without 
+    copying. DataFrames of SHARED_TABLE_VIEWS are rebuilt from the attached
+    arrays and labeled with the zone IDs of tfs.city_zone_coordinates. 
+    Returns the list of attached blocks, which must be kept until the arrays
+    are no longer used.
+    """
+
+    shared_memory_list = []
+
+    for name, (block_name, shape, dtype) in table_specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        shared_memory_list.append(block)
+
+        setattr(
+            tfs,
+            name,
+            np.ndarray(
+                shape,
+                dtype=np.dtype(dtype),
+                buffer=block.buf
+            )
+        )
+
+    zone_id_array = tfs.city_zone_coordinates.index.values
+    for view_name, name in SHARED_TABLE_VIEWS.items():
+        if name in table_specs:
+            setattr(
+                tfs,
+                view_name,
+                pd.DataFrame(
+                    getattr(tfs, name),
+                    index=zone_id_array,
+                    columns=zone_id_array,
+                    copy=False
+                )
+            )
+
+    return shared_memory_list
+
+
+def release_shared_tables(
+    shared_memory_list,
+    unlink=False
+):
+
+    """ Closes all shared memory blocks in shared_memory_list and unlinks 
+    them if unlink is True. """
+
+    for block in shared_memory_list:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def create_unshared_copy(
+    tfs,
+    table_specs
+):
+
+    """ Returns a shallow copy of tfs in which the attributes published in 
+    table_specs and the DataFrames of SHARED_TABLE_VIEWS that wrap them are
+    set to zero, so that it can be sent to worker processes without 
+    pickling these arrays.
+    """
+
+    unshared_tfs = copy.copy(tfs)
+    for name in table_specs:
+        setattr(unshared_tfs, name, 0)
+    for view_name, name in SHARED_TABLE_VIEWS.items():
+        if name in table_specs:
+            setattr(unshared_tfs, view_name, 0)
+
+    return unshared_tfs
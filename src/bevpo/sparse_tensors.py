@@ -0,0 +1,316 @@
+import bevpo.compact_tensors as compact_tensors
+
+import numpy as np
+
+
+class SparseODTensor:
+
+    """ Stores a number_zones x number_zones x T tensor of origin destination
+    values as one compressed sparse row (CSR) matrix per time step. For time
+    step t, the destinations and values of origin zone i are
+    indices[t][indptr[t][i]:indptr[t][i + 1]] and the respective entries of
+    data[t], with destinations sorted in each row. Only positive values are
+    stored, all other entries are zero like missing od pairs of a dense
+    datatensor. Memory then grows with the number of observed od pairs
+    instead of number_zones x number_zones. Indexing with [origin,
+    destination, t] gathers values of zone arrays, and [:, :, t] returns a
+    dense time slice, so that code written for dense datatensors keeps
+    working.
+    """
+
+    def __init__(
+        self,
+        number_zones,
+        T
+    ):
+
+        self.number_zones = number_zones
+        self.T = T
+        self.shape = (
+            number_zones,
+            number_zones,
+            T
+        )
+        index_dtype = compact_tensors.zone_index_dtype(number_zones)
+        self.indptr = [
+            np.zeros(number_zones + 1, dtype=np.int64)
+            for t in range(T)
+        ]
+        self.indices = [
+            np.zeros(0, dtype=index_dtype)
+            for t in range(T)
+        ]
+        self.data = [
+            np.zeros(0)
+            for t in range(T)
+        ]
+
+
+    def set_time_slice(
+        self,
+        t,
+        origin,
+        destination,
+        values
+    ):
+
+        """ Replaces time step t by the values of origin destination pairs of
+        the zone position arrays origin and destination. If a pair appears
+        several times, its last value is kept like in a fancy indexing
+        assignment. Pairs with values that are not positive are not stored.
+        """
+
+        values = np.asarray(values, dtype=float)
+        keys = (
+            np.asarray(origin, dtype=np.int64) * self.number_zones
+            + np.asarray(destination, dtype=np.int64)
+        )
+
+        # sort pairs row-major and keep the last value of repeated pairs
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        values = values[order]
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        keep = last & (values > 0)
+        keys = keys[keep]
+
+        row = keys // self.number_zones
+        self.indptr[t] = np.zeros(self.number_zones + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(row, minlength=self.number_zones),
+            out=self.indptr[t][1:]
+        )
+        self.indices[t] = (keys - row * self.number_zones).astype(
+            self.indices[t].dtype
+        )
+        self.data[t] = values[keep]
+
+
+    def row_ids(self, t):
+
+        """ Returns the origin zone of each stored entry of time step t. """
+
+        return np.repeat(
+            np.arange(self.number_zones),
+            np.diff(self.indptr[t])
+        )
+
+
+    def nnz(self):
+
+        """ Returns the number of stored entries over all time steps. """
+
+        return sum(len(data) for data in self.data)
+
+
+    def to_dense(self, t):
+
+        """ Returns time step t as dense number_zones x number_zones array. """
+
+        dense = np.zeros(
+            (
+                self.number_zones,
+                self.number_zones
+            )
+        )
+        dense[self.row_ids(t), self.indices[t]] = self.data[t]
+
+        return dense
+
+
+    def __getitem__(self, key):
+
+        """ Returns the values of key = (origin, destination, t) with an
+        integer time step t. If origin and destination are zone position
+        arrays, values of all pairs are gathered through one binary search
+        over the sorted row-major keys of t, and missing pairs are zero.
+        Otherwise, the dense time slice is indexed.
+        """
+
+        origin_key, destination_key, t = key
+
+        if isinstance(origin_key, slice) or isinstance(destination_key, slice):
+            return self.to_dense(t)[origin_key, destination_key]
+
+        keys = (
+            self.row_ids(t) * self.number_zones
+            + self.indices[t]
+        )
+        search_keys = (
+            np.asarray(origin_key, dtype=np.int64) * self.number_zones
+            + np.asarray(destination_key, dtype=np.int64)
+        )
+        if len(keys) == 0:
+            return np.zeros(search_keys.shape)
+        position = np.minimum(
+            np.searchsorted(keys, search_keys),
+            len(keys) - 1
+        )
+
+        return np.where(
+            keys[position] == search_keys,
+            self.data[t][position],
+            0
+        )
+
+
+    def max(
+        self,
+        axis=None,
+        out=None,
+        **kwargs
+    ):
+
+        """ Returns the largest value of the tensor, so that numpy.amax()
+        works like on dense datatensors. Only axis=None is supported. """
+
+        if axis is not None:
+            raise ValueError(
+                'SparseODTensor.max() only supports axis=None'
+            )
+
+        return max(
+            [0]
+            + [np.amax(data) for data in self.data if len(data) > 0]
+        )
+
+
+    def sum(
+        self,
+        axis=None,
+        out=None,
+        **kwargs
+    ):
+
+        """ Returns the sum over destinations as number_zones x T array for
+        axis=1, so that numpy.sum(p_dest, axis=1) works like on dense
+        tensors, or the sum of all values for axis=None.
+        """
+
+        if axis is None:
+            return sum(np.sum(data) for data in self.data)
+        if axis != 1:
+            raise ValueError(
+                'SparseODTensor.sum() only supports axis=None and axis=1'
+            )
+
+        row_sum = np.zeros(
+            (
+                self.number_zones,
+                self.T
+            )
+        )
+        for t in range(self.T):
+            row_sum[:, t] = np.bincount(
+                self.row_ids(t),
+                weights=self.data[t],
+                minlength=self.number_zones
+            )
+
+        return row_sum
+
+
+    def left_multiply(
+        self,
+        vector,
+        t
+    ):
+
+        """ Returns the vector-matrix product vector @ tensor[:, :, t] of a
+        vector over origin zones, accumulated over the stored entries of 
+        time step t without a dense time slice.
+        """
+
+        return np.bincount(
+            self.indices[t],
+            weights=self.data[t] * vector[self.row_ids(t)],
+            minlength=self.number_zones
+        )
+
+
+    def create_cumulative_rows(self, t):
+
+        """ Calculates the cumulative distribution of each row of time step t
+        on the stored entries. Each row is normalized to end in 1 and shifted
+        by its origin position, so that the array is sorted and columns of
+        all rows can be sampled with a single searchsorted call. Also returns
+        a boolean array of rows whose values do not sum to zero.
+        """
+
+        row = self.row_ids(t)
+        row_sum = np.bincount(
+            row,
+            weights=self.data[t],
+            minlength=self.number_zones
+        )
+        valid_row = row_sum > 0
+
+        # cumulative sums within each row, i.e. minus the sum of all rows
+        # before. Rows with entries are exactly the valid rows
+        cumulative = np.cumsum(self.data[t])
+        row_end = self.indptr[t][1:]
+        offset = np.zeros(self.number_zones)
+        offset[valid_row] = (
+            cumulative[row_end[valid_row] - 1] - row_sum[valid_row]
+        )
+        cumulative -= offset[row]
+        cumulative /= row_sum[row]
+
+        # normalize rows to end in exactly 1 and shift by origin position
+        np.clip(cumulative, 0, 1, out=cumulative)
+        cumulative[row_end[valid_row] - 1] = 1
+        cumulative += row
+
+        return cumulative, valid_row
+
+
+    def sample_columns(
+        self,
+        t,
+        cumulative,
+        row,
+        random_value
+    ):
+
+        """ Returns the columns of entries in rows row of time step t whose
+        cumulative distribution from create_cumulative_rows() first exceeds
+        random_value, which is shifted by the row positions like cumulative.
+        All rows must be valid.
+        """
+
+        position = np.minimum(
+            np.searchsorted(
+                cumulative,
+                random_value,
+                side='right'
+            ),
+            self.indptr[t][row + 1] - 1
+        )
+
+        return self.indices[t][position]
+
+
+def create_sparse_tensor_from_dense(datatensor):
+
+    """ Returns a SparseODTensor with the positive values of a dense
+    number_zones x number_zones x T datatensor, e.g. from
+    prep_ubermovement.create_od_datatensors(). Converts one time slice at a
+    time, so that datatensor may be backed by a file.
+    """
+
+    number_zones, _, T = datatensor.shape
+    sparse_tensor = SparseODTensor(
+        number_zones,
+        T
+    )
+    for t in range(T):
+        origin, destination = np.nonzero(datatensor[:, :, t] > 0)
+        sparse_tensor.set_time_slice(
+            t,
+            origin,
+            destination,
+            datatensor[origin, destination, t]
+        )
+
+    return sparse_tensor
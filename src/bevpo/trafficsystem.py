@@ -1,9 +1,14 @@
 import bevpo.prob_dist as prob_dist
 import bevpo.samp_traf as samp_traf
+import bevpo.samp_cohort as samp_cohort
 import bevpo.calc_tfsprop as calc_tfsprop
 import bevpo.save_results as save_results
+import bevpo.compact_tensors as compact_tensors
+import bevpo.ensemble as ensemble
+import bevpo.city_bundle as city_bundle
+import bevpo.memmap_tensors as memmap_tensors
+import bevpo.sparse_tensors as sparse_tensors
 
-import math
 import pandas as pd
 import numpy as np
 
@@ -24,7 +29,22 @@ class TrafficSystem:
         e_dest=2,
         p_min=0.1,
         p_max=0.9,
-        cars_per_zone=10
+        cars_per_zone=10,
+        distance_formula='beeline',
+        distance_dtype=np.float64,
+        distance_block_size=512,
+        seed=None,
+        destination_sampling='inverse_cdf',
+        streaming=False,
+        compact_layout=False,
+        include_parked_in_distr=True,
+        sampling_processes=None,
+        sampling_threads=None,
+        number_shards=None,
+        path_to_bundle=None,
+        bundle_prob_dists=False,
+        path_to_memmap=None,
+        sparse_od=False
     ):
 
         ### Parameters
@@ -38,32 +58,82 @@ class TrafficSystem:
         self.p_min = p_min
         self.p_max = p_max
         self.cars_per_zone = cars_per_zone
+        self.distance_formula = distance_formula
+        self.distance_dtype = distance_dtype
+        self.distance_block_size = distance_block_size
+        self.seed = seed
+        self.destination_sampling = destination_sampling
+        self.streaming = streaming
+        self.compact_layout = compact_layout
+        self.include_parked_in_distr = include_parked_in_distr
+        self.sampling_processes = sampling_processes
+        self.sampling_threads = sampling_threads
+        self.number_shards = number_shards
+        self.path_to_bundle = path_to_bundle
+        self.bundle_prob_dists = bundle_prob_dists
+        self.path_to_memmap = path_to_memmap
+        self.sparse_od = sparse_od
         
         ### Attributes
-        self.T = len(od_mean_travel_time_list)
+        # od matrices may also be passed as a ready datatensor
+        if isinstance(od_mean_travel_time_list, np.ndarray):
+            self.T = od_mean_travel_time_list.shape[2]
+        else:
+            self.T = len(od_mean_travel_time_list)
         self.number_zones = len(city_zone_coordinates)
         self.datatensor_mean = 0
         self.datatensor_stddev = 0
+        # own subdirectory of path_to_memmap, created when the first tensor
+        # is backed by a file
+        self.memmap_directory = None
         self.C = round(
             self.number_zones * self.cars_per_zone
         )
-        self.state_tensor = np.zeros(
-            (
-                self.C,
-                self.T
-            )
-        ).astype(int)
-        self.transition_tensor = np.zeros(
-            (
-                self.C,
-                self.T,
-                4 # driving x destination x travel time x distance
-            )
-        )
+        # random number generator used for all sampling. Sampling stages 
+        # draw from independent child streams of it
+        self.rng = np.random.default_rng(seed)
+        # per-car state and transition tensors of the simulation
+        self.create_car_tensors()
         # if no origin-destination travel distances passed,
         # calculate beeline distance between city zone centroids
         if od_distances is None:
-            self.calc_od_distances(city_zone_coordinates)
+            # load distances from city bundle if they are cached for the same
+            # city zones and distance parameters
+            bundle_arrays = city_bundle.load_bundle_arrays(
+                path_to_bundle,
+                ['od_distances_array'],
+                parameters=self.create_bundle_parameters()
+            )
+            if bundle_arrays is not None:
+                self.od_distances_array = bundle_arrays['od_distances_array']
+                # label distances with zone IDs like calc_od_distances() 
+                # does, without copying the memory-mapped array
+                zone_id_array = city_zone_coordinates.index.values
+                self.od_distances = pd.DataFrame(
+                    self.od_distances_array,
+                    index=zone_id_array,
+                    columns=zone_id_array,
+                    copy=False
+                )
+            else:
+                self.calc_od_distances(
+                    city_zone_coordinates,
+                    distance_formula,
+                    distance_dtype,
+                    distance_block_size
+                )
+                self.create_od_distances_array()
+                city_bundle.save_bundle_arrays(
+                    path_to_bundle,
+                    {
+                        'od_distances_array': self.od_distances_array
+                    },
+                    parameters=self.create_bundle_parameters()
+                )
+        else:
+            # keep a contiguous array of distances aligned with datatensor 
+            # zone positions for fast lookups during sampling
+            self.create_od_distances_array()
         
         ### Results placeholders
         self.driving_map = 0
@@ -81,39 +151,156 @@ class TrafficSystem:
         self.distr_bins_km = 0
         self.distr_bins_s = 0
         self.charging_profile_dist = 0
+        self.ensemble_mean = 0
+        self.ensemble_variance = 0
+        self.ensemble_percentiles = 0
+        
+        
+    def create_car_tensors(self):
+
+        """ Allocates the state and transition tensors of all C cars and T
+        time steps. Called on initialization of class objects and for every
+        replication of an ensemble. If streaming=True, no per-car tensors are
+        allocated.
+        """
+        
+        # per-car tensors are not needed when streaming results
+        if self.streaming:
+            self.state_tensor = 0
+            self.transition_tensor = 0
+        # struct of arrays with narrow data types per component
+        elif self.compact_layout:
+            self.state_tensor = np.zeros(
+                (
+                    self.C,
+                    self.T
+                ),
+                dtype=compact_tensors.zone_index_dtype(self.number_zones)
+            )
+            self.transition_tensor = compact_tensors.CompactTransitionTensor(
+                self.C,
+                self.T,
+                self.number_zones
+            )
+        else:
+            self.state_tensor = np.zeros(
+                (
+                    self.C,
+                    self.T
+                )
+            ).astype(int)
+            self.transition_tensor = np.zeros(
+                (
+                    self.C,
+                    self.T,
+                    4 # driving x destination x travel time x distance
+                )
+            )
+        
+
+    def create_bundle_parameters(self, datatensors=False):
+
+        """ Returns the parameters that od distances and probability 
+        distributions cached in a city bundle depend on. The city zones are
+        included as hashes of their IDs and coordinates. If datatensors is 
+        True, the parameters of probability distributions also include 
+        hashes of datatensor_mean and od_distances_array. datatensor_mean is
+        identified by the content hash of the bundle if it is the read-only
+        memory-mapped datatensor of the bundle itself, and hashed one time 
+        slice at a time otherwise.
+        """
+        
+        bundle_parameters = {
+            'zone_id_hash': city_bundle.calc_array_hash(
+                self.city_zone_coordinates.index.values
+            ),
+            'zone_coordinate_hash': city_bundle.calc_array_hash(
+                self.city_zone_coordinates[
+                    ['zone_lat', 'zone_long']
+                ].values.astype(float)
+            ),
+            'distance_formula': self.distance_formula,
+            'distance_dtype': np.dtype(self.distance_dtype).str,
+            'T': self.T,
+            'e_drive': self.e_drive,
+            'e_dest': self.e_dest,
+            'p_min': self.p_min,
+            'p_max': self.p_max
+        }
+
+        if datatensors:
+            datatensor_hash = city_bundle.find_bundle_content_hash(
+                self.path_to_bundle,
+                'datatensor_mean',
+                self.datatensor_mean
+            )
+            if datatensor_hash is None:
+                datatensor_hash = city_bundle.calc_tensor_hash(
+                    self.datatensor_mean
+                )
+            bundle_parameters['datatensor_hash'] = datatensor_hash
+            bundle_parameters['od_distances_hash'] = (
+                city_bundle.calc_array_hash(self.od_distances_array)
+            )
         
+        return bundle_parameters
         
-    def calc_od_distances(self, city_zone_coordinates):
+
+    def calc_od_distances(
+        self,
+        city_zone_coordinates,
+        distance_formula='beeline',
+        distance_dtype=np.float64,
+        distance_block_size=512
+    ):
     
         """ Calculates the beeline distance between origin destination zones
         of a city if no explicit matrix of such distances was past when
-        initializing class object.
+        initializing class object. The full matrix is computed from the
+        zone_lat and zone_long arrays by broadcasting blocks of 
+        distance_block_size origin zones against all destination zones, so 
+        that peak memory stays bounded for large numbers of city zones. 
+        distance_formula is either 'beeline' for the equirectangular 
+        approximation or 'haversine' for great-circle distances.
         """
         
         c_lat_long = 111.3
         conv_deg_rad = 0.01745
+        earth_radius_km = 6371.0
 
-        zone_id_array= city_zone_coordinates.index.values
-        od_distances = pd.DataFrame(0, index=zone_id_array, columns=zone_id_array)
-
-        # iterate over all city zones
-        for entry_num1, zone_id1 in enumerate(zone_id_array):
+        zone_id_array = city_zone_coordinates.index.values
+        lat_array = city_zone_coordinates['zone_lat'].values.astype(float)
+        long_array = city_zone_coordinates['zone_long'].values.astype(float)
+        number_zones = len(zone_id_array)
+        
+        if distance_block_size is None:
+            distance_block_size = max(number_zones, 1)
+        
+        od_distance_array = np.empty(
+            (
+                number_zones,
+                number_zones
+            ),
+            dtype=distance_dtype
+        )
+        
+        # iterate over blocks of origin zones
+        for block_start in range(0, number_zones, distance_block_size):
+            block_end = min(block_start + distance_block_size, number_zones)
             
-            lat1 = city_zone_coordinates.loc[zone_id1]['zone_lat']
-            long1 = city_zone_coordinates.loc[zone_id1]['zone_long']
+            # origin coordinates as column vectors for broadcasting against
+            # destination coordinates as row vectors
+            lat1 = lat_array[block_start:block_end, np.newaxis]
+            long1 = long_array[block_start:block_end, np.newaxis]
+            lat2 = lat_array[np.newaxis, :]
+            long2 = long_array[np.newaxis, :]
             
-            # iterate over all zones up to currently iterated one
-            for entry_num2 in range(entry_num1+1):
-                
-                zone_id2 = zone_id_array[entry_num2]
-                lat2 = city_zone_coordinates.loc[zone_id2]['zone_lat']
-                long2 = city_zone_coordinates.loc[zone_id2]['zone_long']
-                
+            if distance_formula == 'beeline':
                 # calculate beeline distance
                 distance_km = (
-                    c_lat_long * math.sqrt(
+                    c_lat_long * np.sqrt(
                         (
-                            math.cos(
+                            np.cos(
                                 (
                                     lat1
                                     + lat2
@@ -129,22 +316,86 @@ class TrafficSystem:
                         )**2
                     )
                 )
-                
-                # write matrix entries symmetrically with 10% additional 
-                # distance compared to the beeline
-                od_distances.loc[zone_id1, zone_id2] = distance_km * 1.1
-                od_distances.loc[zone_id2, zone_id1] = distance_km * 1.1
+            elif distance_formula == 'haversine':
+                # calculate great-circle distance
+                lat1 = np.radians(lat1)
+                lat2 = np.radians(lat2)
+                haversine_term = (
+                    np.sin((lat2 - lat1) / 2)**2
+                    + np.cos(lat1) * np.cos(lat2) * np.sin(
+                        np.radians(long2 - long1) / 2
+                    )**2
+                )
+                distance_km = (
+                    2 * earth_radius_km * np.arcsin(
+                        np.sqrt(
+                            np.minimum(haversine_term, 1)
+                        )
+                    )
+                )
+            else:
+                raise ValueError(
+                    'Unknown distance_formula {}'.format(distance_formula)
+                )
             
-            # overwrite the diagonal entries with 1 km distances
-            od_distances.loc[zone_id1, zone_id2] = 1
-            od_distances.loc[zone_id2, zone_id1] = 1
+            # write matrix entries with 10% additional distance compared 
+            # to the beeline
+            od_distance_array[block_start:block_end, :] = distance_km * 1.1
             
-        self.od_distances = od_distances
+        # overwrite the diagonal entries with 1 km distances
+        np.fill_diagonal(od_distance_array, 1)
+            
+        self.od_distances = pd.DataFrame(
+            od_distance_array,
+            index=zone_id_array,
+            columns=zone_id_array,
+            copy=False
+        )
+        
+
+    def create_od_distances_array(self):
+    
+        """ Creates a contiguous numpy array of origin destination distances
+        whose rows and columns correspond to index positions in
+        city_zone_coordinates.index and hence to zone positions in the 
+        datatensors. If the od_distances DataFrame is labeled with the zone 
+        IDs of city_zone_coordinates, it is aligned to these first. Otherwise,
+        its rows and columns are expected to be in the same order already.
+        """
+        
+        zone_id_array = self.city_zone_coordinates.index.values
+        od_distances = self.od_distances
+        
+        if (
+            isinstance(od_distances, pd.DataFrame)
+            and (
+                od_distances.index.isin(zone_id_array).sum()
+                == len(zone_id_array)
+            )
+            and (
+                od_distances.columns.isin(zone_id_array).sum()
+                == len(zone_id_array)
+            )
+        ):
+            od_distances = od_distances.reindex(
+                index=zone_id_array,
+                columns=zone_id_array
+            )
+        
+        self.od_distances_array = np.ascontiguousarray(
+            np.asarray(od_distances)
+        )
         
 
-    def simulate_traffic(self):
+    def simulate_traffic(self, mode='cars'):
 
-        """ Simulates the traffic system when called. """
+        """ Simulates the traffic system when called. mode='cars' samples 
+        every single car of the fleet, streaming results if streaming=True.
+        mode='cohorts' only samples the number of cars in each city zone, 
+        which makes runtime independent of the fleet size. 
+        mode='expectation' propagates the expected number of cars in each 
+        city zone without sampling.
+        """
         
         ### Transform data from list of dataframes into single datatensor
         self.create_datatensors()
@@ -152,11 +403,69 @@ class TrafficSystem:
         ### Calculate distributions of driving and choosind a destination
         prob_dist.calc_prob_dists(self)
         
-        ### Sample traffic
-        samp_traf.sample_traffic(self)
+        ### Sample traffic and calculate traffic system properties
+        self.sample_traffic_system(mode)
         
-        ### Calculate traffic system properties
-        calc_tfsprop.calc_traffic_system_properties(self)
+
+    def sample_traffic_system(self, mode='cars'):
+
+        """ Samples traffic with the chosen mode and calculates the traffic 
+        system properties from datatensors and distributions that are already
+        created.
+        """
+        
+        if mode == 'cars':
+            ### Sample traffic
+            samp_traf.sample_traffic(self)
+            
+            ### Calculate traffic system properties
+            if self.streaming:
+                calc_tfsprop.calc_aggregate_system_properties(self)
+            else:
+                calc_tfsprop.calc_traffic_system_properties(self)
+            
+        elif mode == 'cohorts':
+            ### Sample number of cars per city zone
+            samp_cohort.sample_traffic_cohorts(self)
+            
+            ### Calculate traffic system properties
+            calc_tfsprop.calc_aggregate_system_properties(self)
+            
+        elif mode == 'expectation':
+            ### Propagate expected number of cars per city zone
+            samp_cohort.expect_traffic_cohorts(self)
+            
+            ### Calculate traffic system properties
+            calc_tfsprop.calc_aggregate_system_properties(self)
+            
+        else:
+            raise ValueError(
+                'Unknown simulation mode {}'.format(mode)
+            )
+        
+
+    def simulate_traffic_ensemble(
+        self,
+        replications,
+        mode='cars',
+        max_workers=None,
+        percentiles=(5, 50, 95)
+    ):
+
+        """ Simulates the traffic system replications times with independent
+        random number streams spawned from seed. Replications are run in 
+        parallel by a pool of max_workers processes that receive the 
+        datatensors and distributions once, and per-zone means, variances and
+        percentiles of the resulting maps are saved as ensemble results.
+        """
+        
+        ensemble.simulate_ensemble(
+            self,
+            replications,
+            mode,
+            max_workers,
+            percentiles
+        )
         
 
     def create_datatensors(self):
@@ -166,76 +475,98 @@ class TrafficSystem:
         city_zone_coordinates.index. Time step indexing corresponds to 
         respective position of OD matrix in od_mean_travel_time_list.
         If od_stddev_travel_time_list is available, the same is done for this 
-        list too.
+        list too. Lists that are passed as datatensors are used directly.
         """
 
-        datatensor_mean = np.zeros(
-            (
-                self.number_zones,
-                self.number_zones,
-                self.T
-            )
-        )
-        # iterate over all time steps
-        for time in range(self.T):
-            # get od matrix of current time step
-            od_mean_travel_time_df = self.od_mean_travel_time_list[time]
-
-            # iterate over all rows in od matric
-            for index, row in od_mean_travel_time_df.iterrows():
-                # get the mean travel time column only
-                mean = row['mean_travel_time']
-                # set the source id to position where zone coordinate index matches
-                source = int(
-                    np.where(
-                        self.city_zone_coordinates.index.values == row['source_id']
-                    )[0]
-                )
-                # set also destination id to position where zone coordinate 
-                # index matches
-                dest = int(
-                    np.where(
-                        self.city_zone_coordinates.index.values == row['dest_id']
-                    )[0]
-                )
-                # assign mean value to respective datatensor entry
-                datatensor_mean[source, dest, time] = mean
+        # map zone IDs to their index positions once for all time steps
+        zone_id_lookup = pd.Index(self.city_zone_coordinates.index.values)
 
+        # scatter all od matrices into a single datatensor
+        self.datatensor_mean = self.create_datatensor_from_od_list(
+            self.od_mean_travel_time_list,
+            'mean_travel_time',
+            zone_id_lookup
+        )
         # set the list of od matrices to zero for saving memory
         self.od_mean_travel_time_list = 0
-        # save extracted datatensor as class object attribute
-        self.datatensor_mean = datatensor_mean
 
         # do the same for od standard deviations of travel time if available
         if self.od_stddev_travel_time_list is not None:
-            datatensor_stddev = np.zeros(
-                (
-                    self.number_zones,
-                    self.number_zones,
-                    self.T
+            self.datatensor_stddev = self.create_datatensor_from_od_list(
+                self.od_stddev_travel_time_list,
+                'stddev_travel_time',
+                zone_id_lookup
+            )
+            self.od_stddev_travel_time_list = 0
+
+
+    def create_datatensor_from_od_list(
+        self,
+        od_matrix_list,
+        value_column,
+        zone_id_lookup
+    ):
+
+        """ Scatters the values of value_column from a list of od matrices into
+        a number_zones x number_zones x T datatensor. Source and destination
+        IDs of all rows of a time step are mapped to their index positions in
+        city_zone_coordinates.index through zone_id_lookup and then assigned
+        with a single fancy indexing operation. Rows with zone IDs that do not
+        appear in city_zone_coordinates are skipped. If od_matrix_list is 
+        already a datatensor, e.g. from 
+        prep_ubermovement.create_od_datatensors(), it is returned as it is.
+        If sparse_od is True, values are stored in a 
+        sparse_tensors.SparseODTensor instead.
+        """
+
+        if isinstance(od_matrix_list, np.ndarray):
+            if self.sparse_od:
+                return sparse_tensors.create_sparse_tensor_from_dense(
+                    od_matrix_list
                 )
+            return od_matrix_list
+
+        # tensor is sparse or backed by a time-major file if path_to_memmap
+        # is set
+        if self.sparse_od:
+            datatensor = sparse_tensors.SparseODTensor(
+                self.number_zones,
+                self.T
+            )
+        else:
+            datatensor = memmap_tensors.create_tensor(
+                self,
+                value_column
             )
+        # iterate over all time steps
+        for time in range(self.T):
+            # get od matrix of current time step
+            od_matrix_df = od_matrix_list[time]
 
-            for time in range(self.T):
-                od_stddev_travel_time_df = self.od_stddev_travel_time_list[time]
+            # get positions of source and destination zones of all rows
+            source = zone_id_lookup.get_indexer(
+                od_matrix_df['source_id'].values
+            )
+            dest = zone_id_lookup.get_indexer(
+                od_matrix_df['dest_id'].values
+            )
+            values = od_matrix_df[value_column].values
 
-                for index, row in od_stddev_travel_time_df.iterrows():
-                    stddev = row['stddev_travel_time']
-                    source = int(
-                        np.where(
-                            self.city_zone_coordinates.index.values == row['source_id']
-                        )[0]
-                    )
-                    dest = int(
-                        np.where(
-                            self.city_zone_coordinates.index.values == row['dest_id']
-                        )[0]
-                    )
+            # skip rows whose zone IDs are unknown
+            known = (source >= 0) & (dest >= 0)
 
-                datatensor_stddev[source, dest, time] = stddev
+            # assign all values of current time step at once
+            if self.sparse_od:
+                datatensor.set_time_slice(
+                    time,
+                    source[known],
+                    dest[known],
+                    values[known]
+                )
+            else:
+                datatensor[source[known], dest[known], time] = values[known]
 
-            self.od_stddev_travel_time_list = 0
-            self.datatensor_stddev = datatensor_stddev
+        return datatensor
             
             
     def save_tfs_results(self, path_to_results=None):
@@ -2,8 +2,13 @@ import unittest
 import sys
 sys.path.append('/bevpo/src')
 import os
+import tempfile
+import numpy as np
+import pandas as pd
 
 import bevpo.datasets.prep_ubermovement as prep_data
+import bevpo.trafficsystem as trafficsystem
+import bevpo.prob_dist as prob_dist
 
 
 class TestPrepUbermovement(unittest.TestCase):
@@ -276,6 +281,325 @@ class TestPrepUbermovement(unittest.TestCase):
                     'stddev_travel_time' in stddev_matrix.columns
                 )
 
+
+    def test_create_od_datatensors(self):
+    
+        """ test for each Uber Movement city if datatensors read in chunks 
+        contain the same travel times as datatensors created from the lists
+        of OD matrices.
+        """
+
+        # iterate over all cities
+        for city in self.city_list:
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create datatensors from lists of OD matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+            tfs = trafficsystem.TrafficSystem(
+                city_zone_coordinates,
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            )
+            tfs.create_datatensors()
+
+            # read datatensors in chunks
+            (
+                datatensor_mean,
+                datatensor_stddev
+            ) = prep_data.create_od_datatensors(
+                path_to_rawdata,
+                city_zone_coordinates,
+                chunksize=100000
+            )
+            
+            # test if both contain the same values up to float32 precision
+            self.assertTrue(
+                np.allclose(
+                    datatensor_mean,
+                    tfs.datatensor_mean,
+                    rtol=1e-6
+                )
+            )
+            self.assertTrue(
+                np.allclose(
+                    datatensor_stddev,
+                    tfs.datatensor_stddev,
+                    rtol=1e-6
+                )
+            )
+
+            # a list of one time key results in the same datatensors
+            (
+                datatensor_mean_list_key,
+                datatensor_stddev_list_key
+            ) = prep_data.create_od_datatensors(
+                path_to_rawdata,
+                city_zone_coordinates,
+                time_key=['hod'],
+                chunksize=100000
+            )
+            self.assertTrue(
+                np.array_equal(
+                    datatensor_mean,
+                    datatensor_mean_list_key
+                )
+            )
+            self.assertTrue(
+                np.array_equal(
+                    datatensor_stddev,
+                    datatensor_stddev_list_key
+                )
+            )
+
+            # datatensors backed by time-major files contain the same values
+            with tempfile.TemporaryDirectory() as path_to_memmap:
+                (
+                    datatensor_mean_memmap,
+                    datatensor_stddev_memmap
+                ) = prep_data.create_od_datatensors(
+                    path_to_rawdata,
+                    city_zone_coordinates,
+                    chunksize=100000,
+                    path_to_memmap=path_to_memmap
+                )
+                self.assertTrue(
+                    isinstance(
+                        datatensor_mean_memmap,
+                        np.memmap
+                    )
+                )
+                self.assertTrue(
+                    np.array_equal(
+                        datatensor_mean,
+                        datatensor_mean_memmap
+                    )
+                )
+                self.assertTrue(
+                    np.array_equal(
+                        datatensor_stddev,
+                        datatensor_stddev_memmap
+                    )
+                )
+                del datatensor_mean_memmap, datatensor_stddev_memmap
+
+
+    def test_create_time_values(self):
+    
+        """ test if time values of single and combined time keys have the 
+        expected number of time steps and order.
+        """
+        
+        self.assertEqual(
+            len(prep_data.create_time_values('hod')),
+            24
+        )
+        self.assertEqual(
+            len(prep_data.create_time_values('dow')),
+            7
+        )
+        self.assertEqual(
+            len(prep_data.create_time_values('month')),
+            12
+        )
+        
+        # combined time keys iterate over the last key first
+        time_values = prep_data.create_time_values(['dow', 'hod'])
+        self.assertEqual(
+            len(time_values),
+            168
+        )
+        self.assertEqual(
+            time_values[25],
+            (2, 1)
+        )
+
+        # a list of one time key is the same as the time key itself
+        self.assertEqual(
+            prep_data.create_time_values(['hod']),
+            prep_data.create_time_values('hod')
+        )
+        
+        # unknown time keys use the sorted distinct values found in data
+        self.assertEqual(
+            prep_data.create_time_values(
+                'quarter',
+                [3, 1, 2]
+            ),
+            [1, 2, 3]
+        )
+
+
+    def test_create_city_bundle(self):
+    
+        """ test for each Uber Movement city if city bundles return the same
+        city zone coordinates and datatensors as the source files, both when 
+        created and when loaded.
+        """
+
+        # iterate over all cities
+        for city in self.city_list:
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # create city zone coordinates and datatensors from source files
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+            (
+                datatensor_mean,
+                datatensor_stddev
+            ) = prep_data.create_od_datatensors(
+                path_to_rawdata,
+                city_zone_coordinates
+            )
+
+            with tempfile.TemporaryDirectory() as path_to_bundle:
+            
+                # create bundle in first and load it in second iteration
+                for iteration in range(2):
+                    (
+                        bundle_city_zone_coordinates,
+                        bundle_datatensor_mean,
+                        bundle_datatensor_stddev
+                    ) = prep_data.create_city_bundle(
+                        path_to_json_data,
+                        path_to_rawdata,
+                        path_to_bundle
+                    )
+                    
+                    self.assertTrue(
+                        city_zone_coordinates.equals(
+                            bundle_city_zone_coordinates
+                        )
+                    )
+                    self.assertTrue(
+                        np.array_equal(
+                            datatensor_mean,
+                            bundle_datatensor_mean
+                        )
+                    )
+                    self.assertTrue(
+                        np.array_equal(
+                            datatensor_stddev,
+                            bundle_datatensor_stddev
+                        )
+                    )
+
+
+                    # od distances are calculated in the first and loaded 
+                    # from the bundle in the second iteration. Both times, 
+                    # they are labeled with the zone IDs
+                    tfs = trafficsystem.TrafficSystem(
+                        bundle_city_zone_coordinates,
+                        bundle_datatensor_mean,
+                        bundle_datatensor_stddev,
+                        path_to_bundle=path_to_bundle
+                    )
+                    self.assertTrue(
+                        isinstance(
+                            tfs.od_distances,
+                            pd.DataFrame
+                        )
+                    )
+                    self.assertTrue(
+                        tfs.od_distances.index.equals(
+                            city_zone_coordinates.index
+                        )
+                    )
+                    self.assertTrue(
+                        np.array_equal(
+                            tfs.od_distances.values,
+                            tfs.od_distances_array
+                        )
+                    )
+                    
+                    # temporary datatensor files are removed from the bundle
+                    self.assertEqual(
+                        sorted(
+                            name for name in os.listdir(path_to_bundle)
+                            if not name.endswith('.npy')
+                        ),
+                        ['manifest.json']
+                    )
+
+                    # release memory-mapped files before directory is removed
+                    del tfs
+                    del bundle_datatensor_mean, bundle_datatensor_stddev
+
+                # cached od distances and distributions are not reused for 
+                # moved city zones or other travel times with the same IDs
+                moved_city_zone_coordinates = city_zone_coordinates.copy()
+                moved_city_zone_coordinates['zone_lat'] += 1
+                changed_datatensor_mean = np.flip(datatensor_mean, axis=2)
+                tfs_list = []
+                for path in [path_to_bundle, None]:
+                    tfs = trafficsystem.TrafficSystem(
+                        moved_city_zone_coordinates,
+                        changed_datatensor_mean,
+                        datatensor_stddev,
+                        path_to_bundle=path,
+                        bundle_prob_dists=path is not None
+                    )
+                    tfs.create_datatensors()
+                    prob_dist.calc_prob_dists(tfs)
+                    tfs_list.append(tfs)
+
+                self.assertTrue(
+                    np.array_equal(
+                        tfs_list[0].od_distances_array,
+                        tfs_list[1].od_distances_array
+                    )
+                )
+                self.assertTrue(
+                    np.array_equal(
+                        tfs_list[0].p_dest,
+                        tfs_list[1].p_dest
+                    )
+                )
+                del tfs, tfs_list
+
+
 if __name__ == '__main__':
 
     unittest.main()
@@ -3,6 +3,7 @@ import sys
 sys.path.append('/bevpo/src')
 import os
 import random
+import tempfile
 import numpy as np
 
 import bevpo.datasets.prep_ubermovement as prep_data
@@ -257,9 +258,270 @@ class TestProbDist(unittest.TestCase):
                                 sum(distribution),
                                 tfs.p_drive[zone, t]
                         )
+
+
+
+    def test_create_alias_tables_p_dest(self):
+
+        """ Tests if alias tables represent p_dest by reconstructing the
+        distribution of each origin and time step from its table.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic 
+
+            # initiate tfs class object
+            tfs = trafficsystem.TrafficSystem(
+                city_zone_coordinates,
+                od_mean_travel_time_list,
+                od_std_travel_time_list,
+                destination_sampling='alias'
+            )
+            tfs.create_datatensors()
+            
+            # create p_drive, p_dest and alias tables
+            prob_dist.calc_prob_dists(tfs)
+            
+            # test if alias tables reconstruct each valid distribution
+            for zone in range(tfs.number_zones):
+                
+                for t in range(tfs.T):
+                    distribution = tfs.p_dest[zone, :, t]
+                    self.assertEqual(
+                        tfs.p_dest_valid[zone, t],
+                        sum(distribution) > 0
+                    )
+                    if tfs.p_dest_valid[zone, t]:
+                        alias_prob = tfs.p_dest_alias_prob[zone, :, t]
+                        reconstruction = alias_prob.astype(float)
+                        np.add.at(
+                            reconstruction,
+                            tfs.p_dest_alias[zone, :, t],
+                            1 - alias_prob
+                        )
+                        reconstruction /= tfs.number_zones
+                        
+                        self.assertTrue(
+                            np.allclose(
+                                reconstruction,
+                                distribution,
+                                atol=1e-6
+                            )
+                        )
             
             
         
+    def test_create_distribution_p_dest_by_time_slice(self):
+
+        """ Tests if p_dest calculated one time slice at a time into 
+        memory-mapped files equals p_dest calculated in memory.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic 
+
+            # calculate p_dest in memory and backed by files
+            p_dest_list = []
+            with tempfile.TemporaryDirectory() as path_to_memmap:
+                for path in [None, path_to_memmap]:
+                
+                    # initiate tfs class object
+                    tfs = trafficsystem.TrafficSystem(
+                        city_zone_coordinates,
+                        od_mean_travel_time_list,
+                        od_std_travel_time_list,
+                        path_to_memmap=path
+                    )
+                    tfs.create_datatensors()
+                    
+                    # create p_drive and p_dest
+                    prob_dist.calc_prob_dists(tfs)
+                    p_dest_list.append(
+                        np.array(tfs.p_dest)
+                    )
+                    del tfs
+
+                # a second traffic system with the same path_to_memmap does
+                # not overwrite the files of the first one
+                tfs_list = []
+                for e_dest in [2, 4]:
+                    tfs = trafficsystem.TrafficSystem(
+                        city_zone_coordinates,
+                        od_mean_travel_time_list,
+                        od_std_travel_time_list,
+                        e_dest=e_dest,
+                        path_to_memmap=path_to_memmap
+                    )
+                    tfs.create_datatensors()
+                    prob_dist.calc_prob_dists(tfs)
+                    tfs_list.append(tfs)
+
+                self.assertNotEqual(
+                    tfs_list[0].memmap_directory,
+                    tfs_list[1].memmap_directory
+                )
+                self.assertTrue(
+                    np.array_equal(
+                        tfs_list[0].p_dest,
+                        p_dest_list[0]
+                    )
+                )
+                del tfs, tfs_list
+
+            self.assertTrue(
+                np.allclose(
+                    p_dest_list[0],
+                    p_dest_list[1]
+                )
+            )
+
+
+    def test_create_sparse_distribution_p_dest(self):
+
+        """ Tests if p_drive and p_dest calculated on sparse datatensors
+        equal p_drive and p_dest calculated on dense datatensors.
+        """
+
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic
+
+            # calculate distributions on dense and sparse datatensors
+            tfs_list = []
+            for sparse_od in [False, True]:
+
+                # initiate tfs class object
+                tfs = trafficsystem.TrafficSystem(
+                    city_zone_coordinates,
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list,
+                    sparse_od=sparse_od
+                )
+                tfs.create_datatensors()
+
+                # create p_drive and p_dest
+                prob_dist.calc_prob_dists(tfs)
+                tfs_list.append(tfs)
+
+            self.assertTrue(
+                np.allclose(
+                    tfs_list[0].p_drive,
+                    tfs_list[1].p_drive
+                )
+            )
+            for t in range(tfs_list[0].T):
+                self.assertTrue(
+                    np.allclose(
+                        tfs_list[0].p_dest[:, :, t],
+                        tfs_list[1].p_dest[:, :, t]
+                    )
+                )
+                self.assertTrue(
+                    np.array_equal(
+                        tfs_list[0].datatensor_mean[:, :, t],
+                        tfs_list[1].datatensor_mean[:, :, t]
+                    )
+                )
+
+
 if __name__ == '__main__':
 
     unittest.main()
@@ -0,0 +1,293 @@
+import unittest
+import sys
+sys.path.append('/bevpo/src')
+import os
+import numpy as np
+
+import bevpo.datasets.prep_ubermovement as prep_data
+import bevpo.trafficsystem as trafficsystem
+import bevpo.prob_dist as prob_dist
+import bevpo.samp_cohort as samp_cohort
+
+
+class TestSampCohort(unittest.TestCase):
+
+    """ Tests functions defined in samp_cohort.py """
+
+
+    @classmethod
+    def setUpClass(cls):
+
+        """ Runs once before the first test. """
+
+        # set path to data Uber Movement data
+        path_to_data = 'data/public/Uber Movement/'
+        
+        # get list of cities
+        city_list = os.listdir(path_to_data)
+        
+        # choose particular cities or comment out for testing all cities
+        city_list = ['Amsterdam']
+        
+        # set the ciy_list as attribute of unittest.TestCase
+        cls.path_to_data = path_to_data
+        cls.city_list = city_list
+        
+
+    @classmethod
+    def tearDownClass(cls):
+
+        """ Runs once after the last test. """
+        
+        print('Executed test_samp_cohort.py')
+
+
+    def setUp(self):
+
+        """ Runs before every test. """
+
+        pass
+
+
+    def tearDown(self):
+
+        """ Runs after every test. """
+
+        pass
+
+
+    def test_sample_traffic_cohorts(self):
+
+        """ tests if the number of cars is conserved in every time step and
+        if all cars are either driving or parking.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic 
+
+            # initiate tfs class object
+            tfs = trafficsystem.TrafficSystem(
+                city_zone_coordinates,
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            )
+            tfs.create_datatensors()
+            
+            # create p_drive and p_dest 
+            prob_dist.calc_prob_dists(tfs)
+            
+            # sample traffic
+            samp_cohort.sample_traffic_cohorts(tfs)
+            
+            # test if all cars are counted as driving or parking in each
+            # time step
+            for t in range(tfs.T):
+                self.assertEqual(
+                    np.sum(tfs.driving_counts[:, t])
+                    + np.sum(tfs.parking_counts[:, t]),
+                    tfs.C
+                )
+                
+            # test if no negative counts are sampled
+            self.assertGreaterEqual(
+                np.min(tfs.driving_counts),
+                0
+            )
+            self.assertGreaterEqual(
+                np.min(tfs.parking_counts),
+                0
+            )
+            
+            # test if travel distributions count all cars per time step
+            for t in range(tfs.T):
+                self.assertAlmostEqual(
+                    np.sum(tfs.duration_counts_per_t[t, :]),
+                    tfs.C
+                )
+                self.assertAlmostEqual(
+                    np.sum(tfs.distance_counts_per_t[t, :]),
+                    tfs.C
+                )
+
+
+
+    def test_expect_traffic_cohorts(self):
+
+        """ tests if expected traffic conserves the number of cars and is 
+        free of sampling noise, i.e. identical in two repeated calculations.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic twice
+            
+            driving_counts_list = []
+            for repetition in range(2):
+                # initiate tfs class object
+                tfs = trafficsystem.TrafficSystem(
+                    city_zone_coordinates,
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list
+                )
+                tfs.create_datatensors()
+                
+                # create p_drive and p_dest 
+                prob_dist.calc_prob_dists(tfs)
+                
+                # propagate expected traffic
+                samp_cohort.expect_traffic_cohorts(tfs)
+                driving_counts_list.append(tfs.driving_counts)
+            
+            # test if expected number of cars is conserved in each time step
+            for t in range(tfs.T):
+                self.assertAlmostEqual(
+                    np.sum(tfs.driving_counts[:, t])
+                    + np.sum(tfs.parking_counts[:, t]),
+                    tfs.C
+                )
+                
+            # test if results are free of sampling noise
+            self.assertTrue(
+                np.array_equal(
+                    driving_counts_list[0],
+                    driving_counts_list[1]
+                )
+            )
+
+
+    def test_solve_stationary_zone_distribution(self):
+
+        """ tests if the stationary distribution of cars over city zones is
+        the same for sparse and dense datatensors and distributions.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Solve stationary distribution dense and sparse
+            
+            zone_distribution_list = []
+            for sparse_od in [False, True]:
+                # initiate tfs class object
+                tfs = trafficsystem.TrafficSystem(
+                    city_zone_coordinates,
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list,
+                    sparse_od=sparse_od
+                )
+                tfs.create_datatensors()
+                
+                # create p_drive and p_dest 
+                prob_dist.calc_prob_dists(tfs)
+                
+                zone_distribution_list.append(
+                    samp_cohort.solve_stationary_zone_distribution(tfs)
+                )
+            
+            self.assertTrue(
+                np.allclose(
+                    zone_distribution_list[0],
+                    zone_distribution_list[1]
+                )
+            )
+            
+
+if __name__ == '__main__':
+
+    unittest.main()
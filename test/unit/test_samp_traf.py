@@ -4,6 +4,7 @@ sys.path.append('/bevpo/src')
 import os
 import random
 import numpy as np
+import pandas as pd
 
 import bevpo.datasets.prep_ubermovement as prep_data
 import bevpo.trafficsystem as trafficsystem
@@ -475,6 +476,456 @@ class TestSampTraf(unittest.TestCase):
                 )
             )
 
+
+    def test_sample_traffic_streaming(self):
+
+        """ tests if streaming traffic sampling counts every car as either
+        driving or parking in each time step without creating per-car tensors.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic 
+
+            # initiate tfs class object
+            tfs = trafficsystem.TrafficSystem(
+                city_zone_coordinates,
+                od_mean_travel_time_list,
+                od_std_travel_time_list,
+                streaming=True
+            )
+            tfs.create_datatensors()
+            
+            # create p_drive and p_dest 
+            prob_dist.calc_prob_dists(tfs)
+            
+            # sample traffic
+            samp_traf.sample_traffic(tfs)
+            
+            # test if no per-car tensors are created
+            self.assertEqual(
+                tfs.state_tensor,
+                0
+            )
+            self.assertEqual(
+                tfs.transition_tensor,
+                0
+            )
+            
+            # test if all cars are counted in each time step
+            for t in range(tfs.T):
+                self.assertEqual(
+                    np.sum(tfs.driving_counts[:, t])
+                    + np.sum(tfs.parking_counts[:, t]),
+                    tfs.C
+                )
+                self.assertEqual(
+                    np.sum(tfs.duration_counts_per_t[t, :]),
+                    tfs.C
+                )
+
+
+    def test_sample_traffic_processes(self):
+
+        """ tests if sampling shards of cars in worker processes gives the 
+        same per-car tensors for a fixed seed and number of shards, 
+        independent of the number of processes.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic 
+
+            # sample the same shards with one and two worker processes
+            transition_tensor_list = []
+            for sampling_processes in [1, 2]:
+            
+                # initiate tfs class object
+                tfs = trafficsystem.TrafficSystem(
+                    city_zone_coordinates,
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list,
+                    seed=0,
+                    sampling_processes=sampling_processes,
+                    number_shards=4
+                )
+                tfs.create_datatensors()
+                
+                # create p_drive and p_dest 
+                prob_dist.calc_prob_dists(tfs)
+                
+                # sample traffic
+                samp_traf.sample_traffic(tfs)
+                transition_tensor_list.append(tfs.transition_tensor)
+                
+            # test if results do not depend on the number of processes
+            self.assertTrue(
+                np.array_equal(
+                    transition_tensor_list[0],
+                    transition_tensor_list[1]
+                )
+            )
+            
+            # test if parked cars stay in their zone
+            for t in range(tfs.T):
+                parked = tfs.transition_tensor[:, t, 0] == 0
+                self.assertTrue(
+                    np.array_equal(
+                        tfs.transition_tensor[parked, t, 1],
+                        tfs.state_tensor[parked, t]
+                    )
+                )
+
+
+    def test_sample_traffic_threads(self):
+
+        """ tests if sampling shards of cars in threads gives the same 
+        per-car tensors for a fixed seed and number of shards as sampling 
+        them in worker processes and independent of the number of threads.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic 
+
+            # sample the same shards with one and two threads and processes
+            transition_tensor_list = []
+            for sampling_threads, sampling_processes in [
+                (1, None),
+                (2, None),
+                (None, 2)
+            ]:
+            
+                # initiate tfs class object
+                tfs = trafficsystem.TrafficSystem(
+                    city_zone_coordinates,
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list,
+                    seed=0,
+                    sampling_processes=sampling_processes,
+                    sampling_threads=sampling_threads,
+                    number_shards=4
+                )
+                tfs.create_datatensors()
+                
+                # create p_drive and p_dest 
+                prob_dist.calc_prob_dists(tfs)
+                
+                # sample traffic
+                samp_traf.sample_traffic(tfs)
+                transition_tensor_list.append(tfs.transition_tensor)
+                
+            # test if results do not depend on the number of threads and
+            # are the same as from processes
+            for transition_tensor in transition_tensor_list[1:]:
+                self.assertTrue(
+                    np.array_equal(
+                        transition_tensor_list[0],
+                        transition_tensor
+                    )
+                )
+            
+            # test if parked cars stay in their zone
+            for t in range(tfs.T):
+                parked = tfs.transition_tensor[:, t, 0] == 0
+                self.assertTrue(
+                    np.array_equal(
+                        tfs.transition_tensor[parked, t, 1],
+                        tfs.state_tensor[parked, t]
+                    )
+                )
+
+
+    def test_sample_traffic_seed(self):
+
+        """ tests if the same seed reproduces the same per-car tensors and if
+        the driving activity stream is independent of the destination 
+        sampling method.
+        """
+        
+        for city in self.city_list:
+
+            ### 1. Prepare Uber Data 
+
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+
+            ### 2. Simulate traffic 
+
+            # sample twice with the same seed and once with alias tables
+            transition_tensor_list = []
+            for destination_sampling in ['inverse_cdf', 'inverse_cdf', 'alias']:
+            
+                # initiate tfs class object
+                tfs = trafficsystem.TrafficSystem(
+                    city_zone_coordinates,
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list,
+                    seed=0,
+                    destination_sampling=destination_sampling
+                )
+                tfs.create_datatensors()
+                
+                # create p_drive and p_dest 
+                prob_dist.calc_prob_dists(tfs)
+                
+                # sample traffic
+                samp_traf.sample_traffic(tfs)
+                transition_tensor_list.append(tfs.transition_tensor)
+                
+            # test if the same seed reproduces the same results
+            self.assertTrue(
+                np.array_equal(
+                    transition_tensor_list[0],
+                    transition_tensor_list[1]
+                )
+            )
+            
+            # test if driving activity of the first time step does not 
+            # depend on the stream of destination choice sampling
+            self.assertTrue(
+                np.array_equal(
+                    transition_tensor_list[0][:, 0, 0],
+                    transition_tensor_list[2][:, 0, 0]
+                )
+            )
+
+
+
+    def test_sample_traffic_compact_layout(self):
+
+        """ tests if the compact layout samples the same destinations as the
+        dense layout for a synthetic city with more city zones than fit into
+        int16 products of zone positions, and if all trips end in 
+        destinations with positive probability.
+        """
+
+        ### 1. Create synthetic city with 300 city zones
+
+        number_zones = 300
+        T = 4
+        rng = np.random.default_rng(0)
+        zone_id_array = np.arange(1, number_zones + 1)
+        city_zone_coordinates = pd.DataFrame(
+            {
+                'zone_lat': 52.3 + 0.1 * rng.random(number_zones),
+                'zone_long': 4.8 + 0.1 * rng.random(number_zones)
+            },
+            index=pd.Index(
+                zone_id_array,
+                name='zone_id'
+            )
+        )
+
+        # travel times of a random tenth of all od pairs in each time step
+        od_mean_travel_time_list = []
+        od_std_travel_time_list = []
+        for time in range(T):
+            observed = rng.random(number_zones**2) < 0.1
+            source_id = np.repeat(zone_id_array, number_zones)[observed]
+            dest_id = np.tile(zone_id_array, number_zones)[observed]
+            od_mean_travel_time_list.append(
+                pd.DataFrame(
+                    {
+                        'source_id': source_id,
+                        'dest_id': dest_id,
+                        'mean_travel_time': 300 + 1000 * rng.random(
+                            len(source_id)
+                        )
+                    }
+                )
+            )
+            od_std_travel_time_list.append(
+                pd.DataFrame(
+                    {
+                        'source_id': source_id,
+                        'dest_id': dest_id,
+                        'stddev_travel_time': 100 * rng.random(
+                            len(source_id)
+                        )
+                    }
+                )
+            )
+
+
+        ### 2. Simulate traffic 
+
+        # sample serially and in threads with dense and compact layout
+        for sampling_threads in [None, 2]:
+            state_tensor_list = []
+            for compact_layout in [False, True]:
+
+                # initiate tfs class object
+                tfs = trafficsystem.TrafficSystem(
+                    city_zone_coordinates,
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list,
+                    cars_per_zone=2,
+                    seed=0,
+                    compact_layout=compact_layout,
+                    sampling_threads=sampling_threads
+                )
+                tfs.create_datatensors()
+
+                # create p_drive and p_dest 
+                prob_dist.calc_prob_dists(tfs)
+                p_dest = tfs.p_dest
+
+                # sample traffic
+                samp_traf.sample_traffic(tfs)
+                state_tensor_list.append(tfs.state_tensor)
+
+                # test if all trips end in destinations with positive 
+                # probability
+                for t in range(tfs.T):
+                    drive = tfs.transition_tensor[:, t, 0] == 1
+                    origin = tfs.state_tensor[drive, t].astype(int)
+                    destination = tfs.transition_tensor[drive, t, 1].astype(
+                        int
+                    )
+                    moving = np.sum(p_dest[origin, :, t], axis=1) > 0
+                    self.assertTrue(
+                        np.all(
+                            p_dest[
+                                origin[moving],
+                                destination[moving],
+                                t
+                            ] > 0
+                        )
+                    )
+
+            # test if both layouts sample the same traffic
+            self.assertTrue(
+                np.array_equal(
+                    state_tensor_list[0],
+                    state_tensor_list[1]
+                )
+            )
+
+
 if __name__ == '__main__':
 
     unittest.main()
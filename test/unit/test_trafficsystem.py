@@ -3,6 +3,7 @@ import sys
 sys.path.append('/bevpo/src')
 import os
 import random
+import numpy as np
 
 import bevpo.datasets.prep_ubermovement as prep_data
 import bevpo.trafficsystem as trafficsystem
@@ -192,6 +193,155 @@ class TestTrafficSystem(unittest.TestCase):
                 )
         
 
+    def test_create_datatensors(self):
+    
+        """ tests if every row of the OD matrix lists is scattered to the
+        datatensor position of its source and destination zone.
+        """
+
+        # iterate over all cities
+        for city in self.city_list:
+        
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+            
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # create list of OD travel time matrices
+            (
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+
+            # create class instance and transform od lists into datatensors
+            tfs = trafficsystem.TrafficSystem(
+                city_zone_coordinates,
+                od_mean_travel_time_list,
+                od_std_travel_time_list
+            )
+            tfs.create_datatensors()
+            
+            # sample 100 random rows of each time step and compare to tensors
+            zone_id_list = list(city_zone_coordinates.index.values)
+            for t in range(tfs.T):
+                mean_df = od_mean_travel_time_list[t]
+                std_df = od_std_travel_time_list[t]
+                row_sample = random.sample(
+                    range(len(mean_df.index)),
+                    min(100, len(mean_df.index))
+                )
+                
+                for row in row_sample:
+                    source = zone_id_list.index(mean_df['source_id'].iloc[row])
+                    dest = zone_id_list.index(mean_df['dest_id'].iloc[row])
+                    
+                    self.assertEqual(
+                        tfs.datatensor_mean[source, dest, t],
+                        mean_df['mean_travel_time'].iloc[row]
+                    )
+                    self.assertEqual(
+                        tfs.datatensor_stddev[source, dest, t],
+                        std_df['stddev_travel_time'].iloc[row]
+                    )
+
+
+    def test_simulate_traffic_ensemble(self):
+    
+        """ tests if ensemble results of the same seed are reproducible with 
+        different numbers of worker processes and if ensemble means are
+        valid distributions.
+        """
+
+        # iterate over all cities
+        for city in self.city_list:
+        
+            # create the base path to data
+            base_path = self.path_to_data + city + '/'
+            file_list = os.listdir(base_path)
+
+            # search directory for .json files
+            json_file_name = [
+                file for file in file_list if file.endswith('.json')
+            ][0]
+
+            # search directory for .csv files
+            csv_file_name = [
+                file for file in file_list if file.endswith('.csv')
+            ][0]
+
+            # create the full paths to json and csv data
+            path_to_json_data = base_path + json_file_name
+            path_to_rawdata = base_path + csv_file_name
+            
+            # merge into city_zone coordinates
+            city_zone_coordinates = (
+                prep_data.create_city_zone_coordinates(path_to_json_data)
+            )
+
+            # simulate the same ensemble with one and two worker processes
+            ensemble_list = []
+            for max_workers in [1, 2]:
+            
+                # create list of OD travel time matrices
+                (
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list
+                ) = prep_data.create_od_matrix_lists(path_to_rawdata)
+                
+                tfs = trafficsystem.TrafficSystem(
+                    city_zone_coordinates,
+                    od_mean_travel_time_list,
+                    od_std_travel_time_list,
+                    cars_per_zone=1,
+                    seed=0
+                )
+                tfs.simulate_traffic_ensemble(
+                    4,
+                    max_workers=max_workers
+                )
+                ensemble_list.append(tfs)
+                
+            for name in ['driving_map', 'parking_map']:
+                self.assertTrue(
+                    np.array_equal(
+                        ensemble_list[0].ensemble_mean[name],
+                        ensemble_list[1].ensemble_mean[name]
+                    )
+                )
+                self.assertTrue(
+                    np.array_equal(
+                        ensemble_list[0].ensemble_variance[name],
+                        ensemble_list[1].ensemble_variance[name]
+                    )
+                )
+                self.assertAlmostEqual(
+                    np.sum(ensemble_list[0].ensemble_mean[name]),
+                    1
+                )
+                self.assertGreaterEqual(
+                    np.min(ensemble_list[0].ensemble_variance[name]),
+                    0
+                )
+
+
 if __name__ == '__main__':
 
     unittest.main()